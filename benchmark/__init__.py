@@ -0,0 +1 @@
+"""benchmark suite of neuroanalysis, run with `python -m benchmark`."""
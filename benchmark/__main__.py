@@ -0,0 +1,87 @@
+"""run the benchmark suite.
+
+usage:
+    python -m benchmark [--scale small medium large] [-k PATTERN]
+                        [--repeat N] [--output FILE] [--compare FILE]
+
+every case is timed as the best of `repeat` runs, and then run once more
+under tracemalloc for its peak memory. numpy buffers are traced as well,
+memory-mapped files are not. results can be saved as json and compared
+with the results of another version.
+"""
+import argparse
+import gc
+import json
+import tempfile
+import time
+import tracemalloc
+import numpy as np
+from .cases import CASES, SkipCase
+
+SCALES = {'small': 1, 'medium': 5, 'large': 25}
+
+
+def measure(setup, scale, repeat, seed=0):
+    """time a case and trace its peak memory.
+
+    returns:
+    dict of the best wall time (s), throughput (items/s), peak memory (MB)
+    and number of items.
+    """
+    with tempfile.TemporaryDirectory() as tmpdir:
+        run, items = setup(scale, np.random.RandomState(seed), tmpdir)
+        best = np.inf
+        for _ in range(repeat):
+            gc.collect()
+            start = time.perf_counter()
+            run()
+            best = min(best, time.perf_counter() - start)
+
+        gc.collect()
+        tracemalloc.start()
+        try:
+            run()
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+    return {'time': best, 'throughput': items / best, 'peak_mb': peak / 2**20, 'items': items}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m benchmark', description=__doc__.split('\n')[0])
+    parser.add_argument('--scale', nargs='+', default=['small'], choices=list(SCALES))
+    parser.add_argument('-k', dest='pattern', default='', help='only run cases whose name contains PATTERN')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--output', help='save the results as json')
+    parser.add_argument('--compare', help='json results of another version')
+    args = parser.parse_args(argv)
+
+    previous = {}
+    if args.compare:
+        with open(args.compare) as f:
+            previous = json.load(f)
+
+    results = {}
+    print('%-40s %-6s %10s %16s %10s %8s' % ('case', 'scale', 'time (s)', 'throughput', 'peak (MB)', 'speedup'))
+    for name, unit, setup in CASES:
+        if args.pattern not in name:
+            continue
+        for scale in args.scale:
+            key = '%s[%s]' % (name, scale)
+            try:
+                res = results[key] = measure(setup, SCALES[scale], args.repeat)
+            except SkipCase as err:
+                print('%-40s %-6s skipped, missing %s' % (name, scale, err))
+                continue
+            speedup = '%.2fx' % (previous[key]['time'] / res['time']) if key in previous else ''
+            print('%-40s %-6s %10.4f %16s %10.1f %8s' % (name, scale, res['time'],
+                  '%.3g %s/s' % (res['throughput'], unit), res['peak_mb'], speedup))
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=1)
+    return results
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,132 @@
+"""benchmark cases.
+
+a case is a setup function registered with `case`. it receives the scale
+factor, a RandomState and a temporary directory, and returns the function
+to time together with the number of items it processes, so throughput is
+comparable across scales. only the returned function is measured.
+
+cases only use the api of the earliest versions, or check for what they
+need with `requires` and are skipped on versions without it, so the
+suite runs against any version to compare with.
+"""
+import inspect
+import os
+import numpy as np
+from neuroanalysis import spike, waveform
+from neuroanalysis.reader import EDFData
+from neuroanalysis.reader_ import neurolynx_read_csc
+from . import generators as gen
+
+CASES = []
+
+
+class SkipCase(Exception):
+    """the version benchmarked lacks the api of a case."""
+
+
+def requires(available, what):
+    """skip the case unless `available`, reporting `what` is missing."""
+    if not available:
+        raise SkipCase(what)
+
+
+def case(name, unit):
+    """register a benchmark setup under `name`, throughput counted in `unit`."""
+    def decorator(setup):
+        CASES.append((name, unit, setup))
+        return setup
+    return decorator
+
+
+@case('spike.PSTH', 'spikes')
+def psth(scale, rs, tmpdir):
+    duration = 200 * scale
+    train = gen.poisson_train(rs, 20, duration)
+    onsets, _ = gen.marker_table(rs, 50 * scale, duration)
+    return lambda: spike.PSTH(train, onsets, (-0.5, 1.0), binsize=.01, skip_plot=True), train.size
+
+
+@case('spike.crosscorrelogram', 'spikes')
+def crosscorrelogram(scale, rs, tmpdir):
+    duration = 100 * scale
+    target, reference = gen.poisson_units(rs, 2, 20, duration)
+    return lambda: spike.crosscorrelogram(target, reference, (-0.5, 0.5), .01,
+                                          skip_plot=True), target.size + reference.size
+
+
+@case('spike.apply_linear_filter', 'points')
+def apply_linear_filter(scale, rs, tmpdir):
+    duration = 100 * scale
+    train = gen.poisson_train(rs, 20, duration)
+    k = spike.kernel('gaussian', sigma=.05)
+    nbins = 10000 * scale
+    return lambda: spike.apply_linear_filter(train, k, (0, duration), nbins=nbins), nbins
+
+
+@case('waveform.dwt', 'samples')
+def dwt(scale, rs, tmpdir):
+    data = rs.randn(10 * scale, 2000)
+    frange = np.arange(2, 100, 2)
+    return lambda: waveform.dwt(data, 1000, frange), data.size * frange.size
+
+
+@case('waveform.dwt_power', 'samples')
+def dwt_power(scale, rs, tmpdir):
+    data = rs.randn(10 * scale, 2000)
+    decomposed = waveform.dwt(data, 1000, np.arange(2, 100, 2))
+    return lambda: waveform.dwt_power(decomposed, 1000, baseline=(0, .5),
+                                      gaussian_sigma=.05), decomposed.size
+
+
+@case('waveform.create_epoch_bymarker', 'samples')
+def create_epoch_bymarker(scale, rs, tmpdir):
+    duration = 100 * scale
+    data = rs.randn(16, duration * 1000)
+    onsets, _ = gen.marker_table(rs, 20 * scale, duration)
+    return lambda: waveform.create_epoch_bymarker(data, onsets, (-0.5, 1.0), 1000), \
+        16 * onsets.size * 1500
+
+
+@case('reader.EDFData.load(all)', 'samples')
+def edf_load_all(scale, rs, tmpdir):
+    nchn, duration = 16, 60 * scale
+    filename = gen.random_edf(rs, os.path.join(tmpdir, 'all.edf'), nchn, duration)
+
+    def run():
+        raw = EDFData(filename)
+        raw.load(mode='all')
+        return raw
+    return run, nchn * duration * 1000
+
+
+@case('reader.EDFData.load(mmap)+read', 'samples')
+def edf_load_mmap(scale, rs, tmpdir):
+    requires(hasattr(EDFData, 'read_channels'), "EDFData.load(mode='mmap')")
+    nchn, duration = 16, 60 * scale
+    filename = gen.random_edf(rs, os.path.join(tmpdir, 'mmap.edf'), nchn, duration)
+
+    def run():
+        raw = EDFData(filename)
+        raw.load(mode='mmap')
+        return raw.read_channels(range(nchn))
+    return run, nchn * duration * 1000
+
+
+@case('reader.CscReader', 'samples')
+def csc_reader(scale, rs, tmpdir):
+    duration = 10 * scale
+    filename = gen.random_ncs(rs, os.path.join(tmpdir, 'CSC1.ncs'), duration)
+    return lambda: neurolynx_read_csc(filename), duration * 32000
+
+
+@case('reader.CscReader(mmap).iter_chunks', 'samples')
+def csc_reader_chunks(scale, rs, tmpdir):
+    requires('mmap' in inspect.signature(neurolynx_read_csc).parameters
+             and hasattr(neurolynx_read_csc, 'iter_chunks'), "CscReader(mmap=True).iter_chunks")
+    duration = 10 * scale
+    filename = gen.random_ncs(rs, os.path.join(tmpdir, 'CSC2.ncs'), duration)
+
+    def run():
+        reader = neurolynx_read_csc(filename, mmap=True)
+        return sum(np.sum(csc) for _, csc in reader.iter_chunks())
+    return run, duration * 32000
@@ -0,0 +1,87 @@
+"""synthetic data for the benchmarks.
+
+all generators take a numpy.random.RandomState, so a scale always
+produces the same data across versions. the file layouts are defined
+here rather than imported, so the same files are written for any
+version of the package, and the tests write their files with them too.
+"""
+import numpy as np
+
+# .ncs file: a 16 kB text header, then records of
+# uint64 timestamp in microseconds, uint32 channel number, uint32 sample
+# frequency, uint32 number of valid samples and 512 int16 samples
+NCS_HEADER_SIZE = 2**14
+NCS_RECORD = np.dtype([('time', '<Q'), ('channel', '<i'), ('freq', '<i'),
+                       ('valid', '<i'), ('csc', '<h', (512,))])
+
+
+def poisson_train(rs, rate, duration):
+    """homogeneous poisson spike train, sorted spike times in seconds."""
+    n = rs.poisson(rate * duration)
+    return np.sort(rs.uniform(0, duration, n))
+
+
+def poisson_units(rs, nunits, rate, duration):
+    """list of independent poisson trains."""
+    return [poisson_train(rs, rate, duration) for _ in range(nunits)]
+
+
+def marker_table(rs, ntrials, duration, nconditions=4, margin=2.0):
+    """stimulus onsets and their conditions.
+
+    returns:
+    (onsets, conditions), onsets are sorted and kept `margin` seconds
+    away from both ends of the recording.
+    """
+    onsets = np.sort(rs.uniform(margin, duration - margin, ntrials))
+    conditions = rs.randint(0, nconditions, ntrials)
+    return onsets, conditions
+
+
+def write_edf(filename, data, record_duration=1.0, nsamp=100):
+    """write (channel, samples) int16 data into a minimal EDF file."""
+    nchn = np.size(data, 0)
+    nrec = np.size(data, 1) // nsamp
+    field = lambda v, n: ('%s'%v).ljust(n)[:n]
+
+    header = field(0, 8) + field('', 80) + field('', 80) + field('01.01.19', 8) \
+        + field('00.00.00', 8) + field(256*(nchn+1), 8) + field('', 44) \
+        + field(nrec, 8) + field(record_duration, 8) + field(nchn, 4)
+    for width, val in [(16, 'ch%d'), (80, ''), (8, 'uV'), (8, -3276.8), (8, 3276.7),
+                       (8, -32768), (8, 32767), (80, ''), (8, nsamp), (32, '')]:
+        header += ''.join([field(val%i if '%' in str(val) else val, width) for i in range(nchn)])
+
+    with open(filename, 'wb') as f:
+        f.write(header.encode('ascii'))
+        # one record at a time, so large files are not built in memory.
+        for r in range(nrec):
+            f.write(np.ascontiguousarray(data[:, r*nsamp:(r+1)*nsamp], dtype='<i2').tobytes())
+
+
+def random_edf(rs, filename, nchn, duration, fs=1000):
+    """multi-channel EDF file of random samples, one second per record."""
+    data = rs.randint(-1000, 1000, (nchn, int(duration * fs))).astype('i2')
+    write_edf(filename, data, record_duration=1.0, nsamp=fs)
+    return filename
+
+
+def write_ncs(filename, csc, start=1000000, freq=32000):
+    """write int16 samples into a minimal .ncs file, in 512-sample records."""
+    nrec = len(csc) // 512
+    header = "######## Neuralynx Data File Header\r\n-ADBitVolts 0.000000030518\r\n" \
+             "-InputInverted True\r\n"
+    records = np.zeros(nrec, dtype=NCS_RECORD)
+    records['time'] = start + np.round(np.arange(nrec) * 512 * 1e6 / freq)
+    records['freq'] = freq
+    records['valid'] = 512
+    records['csc'] = csc[:nrec*512].reshape((nrec, 512))
+    with open(filename, 'wb') as f:
+        f.write(header.encode('ascii').ljust(NCS_HEADER_SIZE, b'\0'))
+        f.write(records.tobytes())
+
+
+def random_ncs(rs, filename, duration, freq=32000):
+    """single .ncs file of random samples."""
+    csc = rs.randint(-2000, 2000, int(duration * freq)).astype('i2')
+    write_ncs(filename, csc, freq=freq)
+    return filename
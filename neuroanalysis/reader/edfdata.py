@@ -6,14 +6,23 @@ email: yzmiao@protonmail.com
 last update: Apr 22 2019
 """
 
+import os
 import numpy as np
-from .rawdata import AbstractChannel, RawData
+from .rawdata import AbstractChannel, RawData, RecordValue
+
+
+class EDFChannelValue(RecordValue):
+    """
+    lazy view of one EDF channel in memory-mapped data records, in
+    digital values.
+    """
+
 
 class EDFChannel(AbstractChannel):
     
     def __init__(self, name, index, notes, frequency, 
                  physical_unit, physical_dimension, nsamp,
-                 value):
+                 value, physical_min=0, digital_min=0):
         super().__init__()
         self.name = name
         self.index = index
@@ -23,6 +32,8 @@ class EDFChannel(AbstractChannel):
         self.physical_dimension = physical_dimension
         self.nsamp = nsamp
         self.value = value
+        self.physical_min = physical_min
+        self.digital_min = digital_min
         
 
 class EDFData(RawData):
@@ -32,6 +43,7 @@ class EDFData(RawData):
     
     def __init__(self, filename):
         super().__init__(filename)
+        self._records = None
     
     def load(self, mode='headeronly', index=None):
         """
@@ -40,12 +52,14 @@ class EDFData(RawData):
         modes:
         - headeronly [default]: only import file headers and channel headers
         - all: import everything
+        - mmap: map the data records with np.memmap, each channel value
+                is a lazy EDFChannelValue view, only read on access.
         - channel: only import single channel, data would be return as 
                    ndarray, and won't store in class.
         """
         
         _file = open(self.filename, 'rb')
-        if mode in ['headeronly', 'all']:
+        if mode in ['headeronly', 'all', 'mmap']:
             _file_header_buffer = _file.read(256)
             self.meta = {
                 "version": int((_file_header_buffer[0:8]).decode('utf-8').strip()),
@@ -88,7 +102,9 @@ class EDFData(RawData):
                     physical_unit = (_phmax - _phmin) / (_dimax - _dimin),
                     physical_dimension = _phdim,
                     nsamp = _t_nsamp,
-                    value = None))
+                    value = None,
+                    physical_min = _phmin,
+                    digital_min = _dimin))
         else:
             pass # nothing
         
@@ -97,22 +113,100 @@ class EDFData(RawData):
             for idx in range(len(self.continuous_channels)):
                 self.continuous_channels[idx].value = _temp[:, idx, :].flatten()
 
+        elif mode in ['mmap']:
+            self._map_records()
+            for idx, each in enumerate(self.continuous_channels):
+                each.value = EDFChannelValue(self._channel_records(idx))
+
         elif mode in ['channel']:
             assert not isinstance(index, type(None)), "channel index not valid!"
             
-            _nsamp = self.continuous_channels[index].nsamp
-            _chn = self.meta['channel_number']
-            
-            _buffer = []
-            for ridx in range(a.meta['record_length']):
-                _offset = a.meta['header_length'] + _nsamp*2*chidx + _chn*_nsamp*2*ridx
-                _file.seek(_offset)
-                _buffer.append(_file.read(_nsamp*2))
-
             _file.close()
-            return np.frombuffer(b''.join(_buffer), dtype='i2')
+            return np.array(self._channel_records(index)).reshape(-1)
         
         _file.close()
         
         return
+    
+    def _map_records(self):
+        """
+        map the data section as (record_length, samples per record) int16.
+        
+        for channels sharing the same nsamp, this is the
+        (record_length, channel_number, nsamp) layout with the last two
+        axes merged, and each channel occupies a column block of it.
+        """
+        _record_size = sum([each.nsamp for each in self.continuous_channels])
+        _nrec = self.meta['record_length']
+        if _nrec < 0:
+            # unknown record number (-1) while recording, infer from file size
+            _nrec = (os.path.getsize(self.filename) - self.meta['header_length']) // (2*_record_size)
+        
+        self._records = np.memmap(self.filename, dtype='<i2', mode='r',
+                                  offset=self.meta['header_length'],
+                                  shape=(_nrec, _record_size))
+        return self._records
+    
+    def _channel_records(self, index):
+        """
+        (record_length, nsamp) strided view of one channel in the records.
+        """
+        if self._records is None:
+            self._map_records()
+        _offset = sum([each.nsamp for each in self.continuous_channels[:index]])
+        return self._records[:, _offset:_offset+self.continuous_channels[index].nsamp]
+    
+    def read_channels(self, indices, t_start=None, t_stop=None):
+        """
+        read a time window of several channels, scaled to physical unit.
+        
+        only the data records overlapping the window are read, in a single
+        block, and the requested channels are gathered from it at once.
+        requires the headers, i.e. `load()` in any mode beforehand.
+        
+        arguments:
+        - indices: channel index or list of channel indices, all channels
+                   should share the same sampling rate.
+        - t_start: start of the window in seconds [default: None, from 0]
+        - t_stop: end of the window in seconds [default: None, to the end]
+        
+        return:
+        - (n_channels, n_samples) float64 ndarray in physical unit
+        """
+        indices = np.atleast_1d(indices)
+        _channels = [self.continuous_channels[idx] for idx in indices]
+        _nsamp = _channels[0].nsamp
+        if any([each.nsamp != _nsamp for each in _channels]):
+            raise ValueError("channels with different sampling rates.")
+        
+        if self._records is None:
+            self._map_records()
+        _rate = _nsamp / self.meta['record_duration']
+        _total = self._records.shape[0] * _nsamp
+        
+        _start = 0 if t_start is None else int(np.floor(t_start * _rate))
+        if t_stop is None:
+            _stop = _total
+        elif t_start is None:
+            _stop = int(np.floor(t_stop * _rate))
+        else:
+            # fixed length for the same window size, wherever it starts
+            _stop = _start + int(round((t_stop - t_start) * _rate))
+        _start, _stop = max(_start, 0), min(_stop, _total)
+        if _start >= _stop:
+            return np.zeros((len(indices), 0))
+        
+        _r0 = _start // _nsamp
+        _r1 = (_stop - 1) // _nsamp + 1
+        _offsets = np.cumsum([0] + [each.nsamp for each in self.continuous_channels])
+        
+        # one contiguous read of the records, then strided column blocks
+        _block = np.asarray(self._records[_r0:_r1])
+        _block = np.stack([_block[:, _off:_off+_nsamp] for _off in _offsets[indices]])
+        _block = _block.reshape((len(indices), -1))[:, _start-_r0*_nsamp:_stop-_r0*_nsamp]
+        
+        _unit = np.array([each.physical_unit for each in _channels])[:, None]
+        _dimin = np.array([each.digital_min for each in _channels])[:, None]
+        _phmin = np.array([each.physical_min for each in _channels])[:, None]
+        return (_block - _dimin) * _unit + _phmin
             
\ No newline at end of file
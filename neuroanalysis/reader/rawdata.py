@@ -8,6 +8,147 @@ last update: Apr 22 2019
 
 import numpy as np
 import h5py
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+
+class RecordValue(object):
+    """
+    lazy view of one channel in memory-mapped data records.
+    
+    behaves like a 1d array of the channel samples, but nothing is read
+    from disk until it is indexed, sliced or converted by `np.asarray`.
+    only the data records covering the requested samples are touched.
+    """
+    
+    def __init__(self, records, scale=None):
+        """
+        - records: (record_length, nsamp) view into the memmap
+        - scale: factor applied to the values read, None to keep the
+                 stored digital values
+        """
+        self._records = records
+        self._scale = scale
+        self.nsamp = records.shape[1]
+        self.dtype = records.dtype if scale is None else np.dtype('float64')
+        self.size = records.shape[0] * records.shape[1]
+        self.shape = (self.size,)
+        self.ndim = 1
+        
+    def __len__(self):
+        return self.size
+    
+    def __array__(self, dtype=None, copy=None):
+        _value = self._scaled(np.array(self._records).reshape(-1))
+        return _value if dtype is None else _value.astype(dtype)
+    
+    def _scaled(self, value):
+        return value if self._scale is None else value * self._scale
+    
+    def __getitem__(self, key):
+        if isinstance(key, tuple) and len(key) == 1:
+            key = key[0]
+        if isinstance(key, slice):
+            start, stop, step = key.indices(self.size)
+            if step > 0:
+                if start >= stop:
+                    return np.empty(0, dtype=self.dtype)
+                _r0 = start // self.nsamp
+                _r1 = (stop - 1) // self.nsamp + 1
+                _chunk = np.array(self._records[_r0:_r1]).reshape(-1)
+                _base = _r0 * self.nsamp
+                return self._scaled(_chunk[start-_base:stop-_base:step])
+            key = np.arange(start, stop, step)
+            
+        if np.ndim(key) == 0:
+            _idx = int(key)
+            if _idx < 0:
+                _idx += self.size
+            if not 0 <= _idx < self.size:
+                raise IndexError("index %d out of range"%key)
+            return self._scaled(self._records[_idx // self.nsamp, _idx % self.nsamp])
+        
+        key = np.asarray(key)
+        if key.dtype == bool:
+            key = np.flatnonzero(key)
+        key = np.where(key < 0, key + self.size, key)
+        if key.size and (key.min() < 0 or key.max() >= self.size):
+            raise IndexError("index out of range")
+        return self._scaled(np.asarray(self._records[key // self.nsamp, key % self.nsamp]))
+
+
+class HDF5Value(object):
+    """
+    lazy view of a channel value stored in an hdf5 dataset.
+    
+    behaves like the stored array: numpy style indexing and slicing read
+    only the requested part, and `window` reads a time window. the file
+    should stay open while the value is in use.
+    """
+    
+    def __init__(self, dataset, frequency=None):
+        """
+        - dataset: h5py dataset of the value
+        - frequency: sampling rate, required by `window`
+        """
+        self._dataset = dataset
+        self.frequency = frequency
+        self.dtype = dataset.dtype
+        self.shape = dataset.shape
+        self.size = dataset.size
+        self.ndim = dataset.ndim
+        
+    def __len__(self):
+        return self.shape[0]
+    
+    def __array__(self, dtype=None, copy=None):
+        _value = self._dataset[()]
+        return _value if dtype is None else _value.astype(dtype)
+    
+    def __getitem__(self, key):
+        if isinstance(key, tuple) and len(key) == 1:
+            key = key[0]
+        if self.ndim != 1 or isinstance(key, tuple):
+            return self._dataset[key]
+        if isinstance(key, slice):
+            start, stop, step = key.indices(self.size)
+            if step > 0:
+                return self._dataset[start:max(start, stop):step] if start < stop \
+                    else np.empty(0, dtype=self.dtype)
+            key = np.arange(start, stop, step)
+        if np.ndim(key) == 0:
+            return self._dataset[int(key)]
+        
+        # hdf5 selections should be increasing, read each sample once
+        # in order and put them back into the requested order.
+        key = np.asarray(key)
+        if key.dtype == bool:
+            key = np.flatnonzero(key)
+        key = np.where(key < 0, key + self.size, key)
+        if key.size == 0:
+            return np.empty(key.shape, dtype=self.dtype)
+        if key.min() < 0 or key.max() >= self.size:
+            raise IndexError("index out of range")
+        _unique, _inverse = np.unique(key, return_inverse=True)
+        return self._dataset[_unique][_inverse.reshape(key.shape)]
+    
+    def window(self, t_start=None, t_stop=None):
+        """
+        samples between t_start and t_stop, in seconds.
+        
+        windows of the same size have the same length, wherever they start.
+        """
+        if self.frequency is None:
+            raise ValueError("time window of a value without frequency.")
+        _start = 0 if t_start is None else int(np.floor(t_start * self.frequency))
+        if t_stop is None:
+            _stop = self.size
+        elif t_start is None:
+            _stop = int(np.floor(t_stop * self.frequency))
+        else:
+            _stop = _start + int(round((t_stop - t_start) * self.frequency))
+        return self[max(_start, 0):min(_stop, self.size)]
+
 
 class AbstractChannel(object):
     """
@@ -72,6 +213,9 @@ class RawData(object):
         self.event_channels = []
         self.spike_channels = []
         self.continuous_channels = []
+        self._h5file = None
+        self._h5filename = None
+        self._h5files = {}
         
     def load(self, **kwargs):
         pass
@@ -79,11 +223,29 @@ class RawData(object):
     def save(self, **kwargs):
         pass
     
-    def export_hdf5(self, filename, **kwargs):
+    def export_hdf5(self, filename, compression=None, compression_opts=None, shuffle=False,
+                    chunk_samples=2**16, block=2**20, **kwargs):
         """
         export to hdf5 format dataset
+        
+        1d channel values (arrays, lazy record views or h5py datasets) are
+        streamed into chunked datasets `block` samples at a time, so only a
+        few blocks are held in memory. the blocks are written, i.e. encoded
+        and compressed, by a worker thread while the next ones are read.
+        
+        - compression: None, 'gzip' or 'lzf', or a dict of channel name to
+                       one of them to choose per channel
+        - compression_opts: gzip level, or a dict of channel name to level
+        - shuffle: apply the byte shuffle filter, or a dict of channel name
+                   to bool
+        - chunk_samples: samples in each chunk of the value datasets
+        - block: samples read from the channel at a time
+        - kwargs: passed to `create_dataset` of the values, e.g. `chunks`
         """
         
+        def _per_channel(option, name):
+            return option.get(name) if isinstance(option, dict) else option
+        
         _h5file = h5py.File(filename, 'w')
         _h5file.create_dataset('origin', data=self.filename)
         
@@ -91,68 +253,198 @@ class RawData(object):
         for key, val in self.meta.items():
             _meta.create_dataset(key, data=val)
         
+        _pending = deque()
+        
+        def _write(dataset, start, data):
+            # at most two blocks wait for the writer.
+            while len(_pending) >= 2:
+                _pending.popleft().result()
+            _pending.append(_writer.submit(dataset.__setitem__, slice(start, start+len(data)), data))
+        
+        def _export_value(group, name, val):
+            _opts = dict(compression=_per_channel(compression, name),
+                         compression_opts=_per_channel(compression_opts, name),
+                         shuffle=bool(_per_channel(shuffle, name)))
+            _opts.update(kwargs)
+            if not hasattr(val, 'dtype') or len(getattr(val, 'shape', ())) != 1:
+                group.create_dataset('value', data=val, **_opts)
+                return
+            _n = val.shape[0]
+            if _n == 0:
+                group.create_dataset('value', data=np.asarray(val), **_opts)
+                return
+            _opts.setdefault('chunks', (min(chunk_samples, _n),))
+            _dataset = group.create_dataset('value', shape=(_n,), dtype=val.dtype, **_opts)
+            for _start in range(0, _n, block):
+                _write(_dataset, _start, np.asarray(val[_start:_start+block]))
+        
         def _export_channels(channels, group_name):
             _subgroup = _h5file.create_group(group_name)
-            for each in channels:
+            for _position, each in enumerate(channels):
                 _cont_chan_name = each.name if each.name != None else '%03d'%each.index
                 _cont_chan = _subgroup.create_group(_cont_chan_name)
+                # hdf5 iterates groups by name, keep the order of the list
+                _cont_chan.attrs['position'] = _position
                 for key, val in each.serialize().items():
 
                     if isinstance(val, type(None)):
                         _cont_chan.create_dataset(key, data=np.nan)
                     elif key == 'value':
-                        _cont_chan.create_dataset(key, data=val, **kwargs)
+                        _export_value(_cont_chan, _cont_chan_name, val)
                     else:
                         _cont_chan.create_dataset(key, data=val)
                         
-                        
-        _export_channels(self.event_channels, 'event')
-        _export_channels(self.spike_channels, 'spike')
-        _export_channels(self.continuous_channels, 'continuous')
-        
-        _h5file.close()
+        try:
+            with ThreadPoolExecutor(max_workers=1) as _writer:
+                _export_channels(self.event_channels, 'event')
+                _export_channels(self.spike_channels, 'spike')
+                _export_channels(self.continuous_channels, 'continuous')
+                while _pending:
+                    _pending.popleft().result()
+        finally:
+            _h5file.close()
+    
+    def _open_hdf5(self, filename=None):
+        if filename == None:
+            filename = self._h5filename or self.filename
+        if self._h5file is not None:
+            if self._h5file.id.valid and self._h5filename == filename:
+                return self._h5file
+            self.close_hdf5()
+        self._h5file = h5py.File(filename, 'r')
+        self._h5filename = filename
+        return self._h5file
     
-    def restore_hdf5(self, filename=None, importAll=True):
+    def close_hdf5(self):
+        """
+        close the hdf5 files the lazy channel values are read from.
+        """
+        if self._h5file is not None:
+            self._h5file.close()
+            self._h5file = None
+        for each in self._h5files.values():
+            each.close()
+        self._h5files = {}
+    
+    @staticmethod
+    def _restore_scalar(val):
+        _val = val[()]
+        if isinstance(_val, bytes):
+            return _val.decode()
+        if np.ndim(_val) == 0 and isinstance(_val, np.floating) and np.isnan(_val):
+            return None  # exported from None
+        return _val
+    
+    def _restore_channel(self, group, importdata=True, lazy=True):
+        _c = {}
+        for key, val in group.items():
+            if key == 'value':
+                continue
+            _c[key] = self._restore_scalar(val)
+        if importdata and 'value' in group:
+            _value = group['value']
+            if _value.ndim == 0:
+                _c['value'] = self._restore_scalar(_value)
+            elif lazy:
+                _c['value'] = HDF5Value(_value, frequency=_c.get('frequency'))
+            else:
+                _c['value'] = _value[()]
+        return AbstractChannel(**_c)
+    
+    def restore_hdf5(self, filename=None, importAll=True, lazy=True):
         """
         restore from hdf5 format dataset
+        
+        only the headers are read. with `lazy`, every channel value is an
+        `HDF5Value` reading from the file on access, and the file is kept
+        open until `close_hdf5()`; otherwise the values are read into
+        memory and the file is closed.
+        
+        - filename: exported hdf5 file [default: None, the file restored
+                    from before, or self.filename]
+        - importAll: restore channel values as well, otherwise None
+        - lazy: keep values on disk [default: True]
         """
-        if filename == None:
-            filename = self.filename
+        _f = self._open_hdf5(filename)
+        try:
+            self.filename = self._restore_scalar(_f['origin'])
+            self.meta = {key: self._restore_scalar(val) for key, val in _f['meta'].items()}
             
-        with h5py.File('test.h5', 'r') as _f:
-            self.filename = _f['origin'].value
-            _meta = {}
-            for key, val in _f['meta'].items():
-                _meta[key] = val.value
-            self.meta = _meta
-
             def _restore_channels(name, importdata=True):
-                _channels = []
-                for _ch_name in _f[name].keys():
-                    _c = {}
-                    for key, val in _f['%s/%s'%(name, _ch_name)].items():
-                        if not importdata and key == 'value':
-                            continue
-                        _c[key] = val.value
-                    _ch = AbstractChannel(**_c)
-                    _channels.append(_ch)
+                _groups = list(_f[name].values())
+                _ordered = all(['position' in each.attrs for each in _groups])
+                if _ordered:
+                    _groups.sort(key=lambda x: x.attrs['position'])
+                _channels = [self._restore_channel(_group, importdata, lazy)
+                             for _group in _groups]
+                if not _ordered and all([each.index is not None for each in _channels]):
+                    _channels.sort(key=lambda x: x.index)
                 return _channels
             
             self.continuous_channels = _restore_channels('continuous', importAll)
             self.spike_channels = _restore_channels('spike', importAll)
             self.event_channels = _restore_channels('event', importAll)
+        finally:
+            if not lazy:
+                self.close_hdf5()
             
-    def restore_hdf5_channel(self, chtype, chname):
-        pass  # TODO
+    def restore_hdf5_channel(self, chtype, chname, filename=None, lazy=True):
+        """
+        restore a single channel from hdf5 format dataset
+        
+        the channel replaces the one of the same name, or is appended. a
+        file other than the one restored from is opened on its own, so the
+        lazy values restored before stay readable.
+        
+        - chtype: 'continuous', 'spike' or 'event'
+        - chname: name of the channel group
+        - filename: exported hdf5 file [default: None, the file restored
+                    from before, or self.filename]
+        - lazy: keep the value on disk, see `restore_hdf5`
+        
+        return:
+        - the restored AbstractChannel
+        """
+        if chtype not in ('continuous', 'spike', 'event'):
+            raise ValueError("unknown channel type: %s"%chtype)
+        _default = self._h5filename or self.filename
+        if filename == None:
+            filename = _default
+        if filename == _default:
+            _opened = self._h5file is None or not self._h5file.id.valid
+            _f = self._open_hdf5(filename)
+        else:
+            _f = self._h5files.get(filename)
+            _opened = _f is None or not _f.id.valid
+            if _opened:
+                _f = h5py.File(filename, 'r')
+        try:
+            _ch = self._restore_channel(_f['%s/%s'%(chtype, chname)], lazy=lazy)
+        finally:
+            # keep the files of the lazy values restored before
+            if _opened and not lazy:
+                _f.close()
+                if _f is self._h5file:
+                    self._h5file = None
+            elif _opened and _f is not self._h5file:
+                self._h5files[filename] = _f
+        
+        _channels = getattr(self, '%s_channels'%chtype)
+        _names = [each.name for each in _channels]
+        if _ch.name in _names:
+            _channels[_names.index(_ch.name)] = _ch
+        else:
+            _channels.append(_ch)
+        return _ch
     
     def getchannel_byname(self, channels, name):
         try:
             if channels == 'continuous':
-                return list(filter(lambda x:x.name == name, a.continuous_channels))[0]
+                return list(filter(lambda x:x.name == name, self.continuous_channels))[0]
             if channels == 'spike':
-                return list(filter(lambda x:x.name == name, a.spike_channels))[0]
+                return list(filter(lambda x:x.name == name, self.spike_channels))[0]
             if channels == 'event':
-                return list(filter(lambda x:x.name == name, a.event_channels))[0]
+                return list(filter(lambda x:x.name == name, self.event_channels))[0]
             else:
                 return None
         except IndexError:
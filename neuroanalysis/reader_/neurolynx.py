@@ -1,5 +1,16 @@
 import numpy as np
 import re
+from ..reader.rawdata import RecordValue
+
+# The format for a .ncs files according the the neuralynx docs is
+# uint64 - timestamp in microseconds
+# uint32 - channel number
+# uint32 - sample freq
+# uint32 - number of valid samples
+# int16 x 512 - actual csc samples
+_NCS_HEADER_SIZE = 2**14
+_NCS_RECORD = np.dtype([('time', '<Q'), ('channel', '<i'), ('freq', '<i'),
+                        ('valid', '<i'), ('csc', '<h', (512,))])
 
 
 class CscReader(object):
@@ -9,7 +20,7 @@ Unless you want to sort the spike from the sampling data,
 you shouldn't use this reader.
 
 Attributes:
-    - \_time: timeline in numpy.ndarray
+    - \_time: timeline in numpy.ndarray, computed on first access
     - \_csc:  analogy voltage in numpy.ndarray
     - \_raw:  raw data
 
@@ -23,32 +34,125 @@ Example:
     >>> mycsc._csc
     >>> mycsc._time
 
+Timestamps of any sample range, or the sample index of any time point,
+are available without building the whole timeline:
+
+.. code-block::python
+    >>> mycsc.get_time(0, 32000)
+    >>> mycsc.time_to_index([1.5e6, 2.5e6])
+
+For long recordings, map the file instead and stream over it:
+
+.. code-block::python
+    >>> mycsc = reader.neurolynx_read_csc("path/to/csc/file", mmap=True)
+    >>> for time, csc in mycsc.iter_chunks(1024):
+    ...     pass
+
     
 """
-    def __init__(self, filename, with_analogy=True):
-        """Denoted as reader.neurolynx_read_csc"""
+    def __init__(self, filename, with_analogy=True, mmap=False):
+        """Denoted as reader.neurolynx_read_csc
+
+With mmap=True, the records are memory-mapped and `_csc` is not
+computed; use `iter_chunks` to read the data block by block.
+        """
+        self.__stamps = None
+        self.__steps = None
+        self.__time = None
         with open(filename, 'rb') as _cscfile:
             self._header = ''.join([chr(i)
-                                    for i in _cscfile.read(2**14) if i != 0])
-            # The format for a .ncs files according the the neuralynx docs is
-            # uint64 - timestamp in microseconds
-            # uint32 - channel number
-            # uint32 - sample freq
-            # uint32 - number of valid samples
-            # int16 x 512 - actual csc samples
-            dt = np.dtype([('time', '<Q'), ('channel', '<i'), ('freq', '<i'),
-                           ('valid', '<i'), ('csc', '<h', (512,))])
-            # five points for fast numpy dtype reading
-            self._raw = np.fromfile(_cscfile, dt)
+                                    for i in _cscfile.read(_NCS_HEADER_SIZE) if i != 0])
+            if not mmap:
+                # five points for fast numpy dtype reading
+                self._raw = np.fromfile(_cscfile, _NCS_RECORD)
+        if mmap:
+            self._raw = np.memmap(filename, dtype=_NCS_RECORD, mode='r',
+                                  offset=_NCS_HEADER_SIZE)
 
         self._ADBitVolts = float(self.getAttribute("ADBitVolts"))
-        self._csc = self._raw['csc'].reshape((self._raw['csc'].size,))  # one-dimension
-        self._csc = self._csc * 1e6 * self._ADBitVolts
+        self._scale = 1e6 * self._ADBitVolts
         if self.getAttribute("InputInverted") == 'True':
-            self._csc = - self._csc
-        self._time = self.__get_time()
+            self._scale = - self._scale
+        if mmap:
+            return
+
+        self._csc = self._raw['csc'].reshape((self._raw['csc'].size,))  # one-dimension
+        self._csc = self._csc * self._scale
         return
 
+    @property
+    def signal(self):
+        """
+Lazy view of the voltage, read from the records only when indexed.
+
+Available with or without mmap, e.g. for epoching without loading.
+        """
+        return RecordValue(self._raw['csc'], scale=self._scale)
+
+    @property
+    def _time(self):
+        if self.__time is None:
+            self.__time = self.get_time()
+        return self.__time
+
+    def get_time(self, start=0, stop=None):
+        """
+Timestamps of samples [start, stop), in microseconds.
+
+Sample times are interpolated from the timestamps of their own record
+and the next one, and only the records covering the range are used.
+
+Args:
+    - start: first sample index, default as 0
+    - stop: end sample index (exclusive), default as None, i.e. the end
+
+Returns:
+    - timestamps in numpy.ndarray
+        """
+        start, stop, _ = slice(start, stop).indices(len(self._raw) * 512)
+        if start >= stop:
+            return np.zeros(0)
+        _r0, _r1 = start // 512, (stop - 1) // 512 + 1
+        return self.__records_time(_r0, _r1)[start-_r0*512:stop-_r0*512]
+
+    def time_to_index(self, t):
+        """
+Sample index of time points, by binary search over the record timestamps.
+
+Equivalent to `np.searchsorted(self._time, t)`, i.e. the index of the
+first sample at or after t, without building the timeline.
+
+Args:
+    - t: time in microseconds, scalar or array
+
+Returns:
+    - sample index, int or numpy.ndarray
+        """
+        _stamps, _steps = self.__record_steps()
+        _t = np.asarray(t, dtype='float64')
+        _ridx = np.clip(np.searchsorted(_stamps, _t, side='right') - 1, 0, None)
+        _offset = np.clip(np.ceil((_t - _stamps[_ridx]) / _steps[_ridx]), 0, 512)
+        _idx = np.minimum(_ridx * 512 + _offset.astype('int64'), len(_stamps) * 512)
+        return int(_idx) if np.ndim(_idx) == 0 else _idx
+
+    def iter_chunks(self, n_records=1024):
+        """
+Iterate over the recording in blocks of records.
+
+Each block holds n_records * 512 samples (the last one may be shorter),
+so the memory used is bounded by the block size, not the file size.
+
+Args:
+    - n_records: number of records in each block, default as 1024
+
+Yields:
+    - (time, csc): timestamps and voltage of the block in numpy.ndarray
+        """
+        for _start in range(0, len(self._raw), n_records):
+            _stop = min(_start + n_records, len(self._raw))
+            _csc = self._raw['csc'][_start:_stop].reshape(-1) * self._scale
+            yield self.__records_time(_start, _stop), _csc
+
     def getAttribute(self, attr):
         """
 Get the key-value in the header.
@@ -63,11 +167,18 @@ Including:
         else:
             return False
 
-    def __get_time(self):
-        ts = np.zeros(self._csc.shape)
-        ts[::512] = self._raw['time']
-        xo = np.arange(0, ts.size)
-        ts = np.interp(xo, xo[::512], ts[::512])
-        # the last few are just filled with a constant, so increment them
-        ts[-511:] = ts[-512] + (1 + np.arange(511)) * (ts[512] - ts[0]) / 512.0
-        return ts
+    def __record_steps(self):
+        """record timestamps and the sample interval within each record."""
+        if self.__stamps is None:
+            self.__stamps = self._raw['time'].astype('float64')
+            # the last record continues with the step of the first record
+            _next = np.append(self.__stamps[1:],
+                              self.__stamps[-1] + self.__stamps[1] - self.__stamps[0])
+            self.__steps = (_next - self.__stamps) / 512.0
+        return self.__stamps, self.__steps
+
+    def __records_time(self, start, stop):
+        """timestamps of every sample in records [start, stop)."""
+        _stamps, _steps = self.__record_steps()
+        return (_stamps[start:stop, None]
+                + np.arange(512) * _steps[start:stop, None]).reshape(-1)
@@ -1,8 +1,17 @@
 from .SpikeUnit import SpikeUnit
 import numpy as np
+import scipy.signal as signal
 
 
-def gaussian_kernel(sigma):
+def _declare(k, name, support, **args):
+    """attach the kernel name, arguments and support (lo, hi) to the function."""
+    k.name = name
+    k.args = args
+    k.support = support
+    return k
+
+
+def gaussian_kernel(sigma, truncate=5):
     """
 The gaussian kernel.
 
@@ -10,22 +19,32 @@ The gaussian kernel.
     w(\\tau) = \\frac{1}{\\sqrt{2 \\pi} \\sigma_w}
     \\exp(-\\frac{\\tau^2}{2 \\sigma^2_w})
 
+The support is truncated at `truncate` sigma, i.e. (-5 sigma, 5 sigma)
+by default; spikes beyond it are skipped by the linear filter. Set
+truncate to None to keep the whole support.
+
 example:
 
 .. code-block:: python
 
     >>> kernel('guassian', {'sigma': 0.4})
     """
-    return lambda t: 1/(np.sqrt(2*np.pi)*sigma) * np.exp(-t**2/(2*sigma**2))
+    _width = np.inf if truncate is None else truncate*sigma
+    return _declare(lambda t: 1/(np.sqrt(2*np.pi)*sigma) * np.exp(-t**2/(2*sigma**2)),
+                    'gaussian', (-_width, _width), sigma=sigma, truncate=truncate)
 
 
-def causal_kernel(alpha):
+def causal_kernel(alpha, truncate=15):
     """
 The causal kernel.
 
 .. math::
     w(\\tau) = [\\alpha^2 \\tau \\exp(- \\alpha \\tau)]_+
 
+The support is truncated at `truncate` / alpha, i.e. (0, 15 / alpha) by
+default; spikes beyond it are skipped by the linear filter. Set truncate
+to None to keep the whole support.
+
 example:
 
 .. code-block:: python
@@ -36,7 +55,8 @@ example:
         v = alpha**2 * t * np.exp(-alpha*t)
         v[v<0] = 0
         return v
-    return causal
+    _width = np.inf if truncate is None else truncate/alpha
+    return _declare(causal, 'causal', (0, _width), alpha=alpha, truncate=truncate)
 
 
 def rectangular_kernel(delta):
@@ -56,7 +76,8 @@ example:
     >>> kernel('square', {'delta': 0.4})
 
     """
-    return lambda t: np.ones_like(t[(t>=-delta/2)&(t<=delta/2)]) / delta
+    return _declare(lambda t: ((t>=-delta/2)&(t<=delta/2)) / delta,
+                    'square', (-delta/2, delta/2), delta=delta)
 
 
 def kernel(name, **args):
@@ -64,8 +85,8 @@ def kernel(name, **args):
 Get the kernel function.
 
 Kernels:
-    - gaussian, args: [sigma]
-    - causal, args: [alpha]
+    - gaussian, args: [sigma, truncate]
+    - causal, args: [alpha, truncate]
     - square, args: [delta]
 
 Args:
@@ -116,12 +137,113 @@ Args:
 Returns:
     - kernel lambda function
 
+If the kernel declares its support, as those from `kernel()`, only the
+spikes inside the support are looked up, by binary search on the
+sorted train.
+
     """
     target = _check_and_convert_to_ndarray(to)
-    return lambda t: np.sum(k(target - t))
+    if not hasattr(k, 'support'):
+        return lambda t: np.sum(k(target - t))
+
+    if np.any(target[1:] < target[:-1]):
+        target = np.sort(target)
+
+    def linear_filter(t):
+        _start, _stop = _support_window(target, k, t)
+        return np.sum(k(target[_start:_stop] - t))
+    return linear_filter
+
+
+def _support_window(target, k, t):
+    """index range of the sorted spikes inside the kernel support around t."""
+    _lo, _hi = k.support
+    # a slightly wider window, the kernel itself is zero outside
+    _margin = 1e-9 * (np.abs(t) + _hi - _lo)
+    return (np.searchsorted(target, t + _lo - _margin, side='left'),
+            np.searchsorted(target, t + _hi + _margin, side='right'))
+
 
+def _windowed_linear_filter(target, k, x, block=2**20):
+    """
+Evaluate the exact linear filter at every point of x at once.
 
-def apply_linear_filter(to, k, x_range=None, nbins=1000, returnX=True):
+The spikes inside the kernel support of each point are gathered with
+binary search, and the kernel values are summed per point with
+bincount, in blocks of about `block` (spike, point) pairs.
+    """
+    if np.any(target[1:] < target[:-1]):
+        target = np.sort(target)
+    x = np.ravel(x)
+    _start, _stop = _support_window(target, k, x)
+    _count = _stop - _start
+    _cum = np.cumsum(_count)
+
+    _result = np.zeros(x.size)
+    _edges = np.searchsorted(_cum, np.arange(block, _cum[-1] if x.size else 0, block))
+    for _a, _b in zip(np.hstack((0, _edges)), np.hstack((_edges, x.size))):
+        _c = _count[_a:_b]
+        _offsets = np.hstack((0, np.cumsum(_c)))
+        _idx = np.arange(_offsets[-1]) - np.repeat(_offsets[:-1] - _start[_a:_b], _c)
+        _lags = target[_idx] - np.repeat(x[_a:_b], _c)
+        _result[_a:_b] = np.bincount(np.repeat(np.arange(_b - _a), _c),
+                                     weights=k(_lags), minlength=_b - _a)
+    return _result
+
+
+def _binned_linear_filter(target, k, x_range, resolution=None):
+    """
+Evaluate the linear filter by binning the spikes onto a regular grid
+and convolving with the sampled kernel.
+
+Each spike is split linearly between its two neighbouring grid nodes,
+so the error against the exact sum shrinks with the grid step. The
+convolution switches to FFT for long kernels. The square kernel is
+counted exactly with binary search instead.
+    """
+    if np.any(target[1:] < target[:-1]):
+        target = np.sort(target)
+    if k.name == 'square':
+        # the moving window count is exact with binary search
+        _half = k.args['delta'] / 2
+        return (np.searchsorted(target, x_range + _half, side='right')
+                - np.searchsorted(target, x_range - _half, side='left')) / k.args['delta']
+
+    if not np.all(np.isfinite(k.support)):
+        raise ValueError("binned method requires a kernel with finite support")
+
+    _start, _stop = np.min(x_range), np.max(x_range)
+    if resolution is None:
+        resolution = (_stop - _start) / max(np.size(x_range) - 1, 1)
+    if resolution <= 0:
+        raise ValueError("invalid resolution: "+str(resolution))
+
+    _lo = int(np.floor(k.support[0] / resolution))
+    _hi = int(np.ceil(k.support[1] / resolution))
+    _nout = int(np.ceil((_stop - _start) / resolution)) + 1
+    _grid = _start + np.arange(_nout) * resolution
+
+    # grid nodes n (relative to _start) needed by the outputs: [_lo, _nout + _hi)
+    _nodes = _nout + _hi - _lo
+    _sel = target[(target >= _start + (_lo - 1) * resolution)
+                  & (target < _start + (_nout + _hi) * resolution)]
+    _pos = (_sel - _start) / resolution - _lo
+    _left = np.floor(_pos).astype('int')
+    _frac = _pos - _left
+    _rho = np.bincount(np.clip(_left, 0, _nodes-1), weights=(1 - _frac) * (_left >= 0),
+                       minlength=_nodes+1)[:_nodes]
+    _rho += np.bincount(np.clip(_left + 1, 0, _nodes-1), weights=_frac * (_left + 1 < _nodes),
+                        minlength=_nodes+1)[:_nodes]
+
+    with np.errstate(over='ignore', invalid='ignore'):
+        _kernel = k(np.arange(_lo, _hi + 1) * resolution)
+    # f(grid[m]) = sum_d rho[m + d - _lo] * k(d * resolution)
+    _value = signal.convolve(_rho, _kernel[::-1], mode='valid', method='auto')
+    return np.interp(x_range, _grid, _value)
+
+
+def apply_linear_filter(to, k, x_range=None, nbins=1000, returnX=True,
+                        method='exact', resolution=None):
     """
 Map linear filter into a ndarray.
 
@@ -131,6 +253,11 @@ Args:
     - x_range: time range tuple (starttime, endtime), default as None
     - nbins: number of steps, default as 1000
     - returnX: return timespan ndarray
+    - method: 'exact' sums the kernel over the spike train for each point;
+              'binned' bins the spikes and convolves with the sampled kernel,
+              only for kernels from `kernel()`. default as 'exact'
+    - resolution: grid step of the 'binned' method, smaller is closer to
+                  the exact sum, default as None, i.e. the step of x_range
 
 Returns:
     - [X_range,] discrete_linear_filter
@@ -149,16 +276,31 @@ Returns:
     else:
         raise ValueError("invalid x_range")
 
+    if method == 'binned':
+        if not hasattr(k, 'support'):
+            raise ValueError("binned method requires a kernel from kernel()")
+        _filtered = _binned_linear_filter(target, k, x_range, resolution)
+    elif method == 'exact':
+        _filtered = np.array(list(map(linear_filter, x_range)))  # XXX
+    else:
+        raise ValueError("unknown method: "+str(method))
+
     if returnX:
-        return x_range, np.array(list(map(linear_filter, x_range)))  # XXX
+        return x_range, _filtered
     else:
-        return np.array(list(map(linear_filter, x_range)))
+        return _filtered
 
 
-def apply_linear_filter_withroi(train, k, starts, roi=(0,0), nbins=1000, pbar=None):
+def apply_linear_filter_withroi(train, k, starts, roi=(0,0), nbins=1000, pbar=None,
+                                method='exact', resolution=None):
     """
 Map linear filter into a ndarray with a region of interest.
 
+The time points of all trials are built at once. For kernels from
+`kernel()`, the 'exact' method sums the kernel over the spikes inside
+its support for all points together; the 'binned' method filters the
+train once on a regular grid and gathers every trial from it.
+
 Args:
     - to: data in numpy.ndarray or SpikeUnit class
     - k: kernel
@@ -166,22 +308,33 @@ Args:
     - roi: region of interest, in time tuple (starttime, endtime)
     - nbins: number of steps, default as 1000
     - pbar: progress bar in tqdm
+    - method: 'exact' or 'binned', as in `apply_linear_filter`
+    - resolution: grid step of the 'binned' method, default as None,
+                  i.e. the step of each trial, (roi[1]-roi[0])/(nbins-1)
 
 Returns:
-    - _mean_response: 1-d ndarray
+    - _mean_response: (n_trials, nbins) ndarray
     """
-    _mean_response = None
-
-    for each_start in starts:
-        a = apply_linear_filter(train, k,
-                                x_range=(each_start+roi[0], each_start+roi[1]),
-                                nbins=nbins, returnX=False)
-        if _mean_response is None:
-            _mean_response = a
-        else:
-            _mean_response = np.vstack((_mean_response, a))
+    target = _check_and_convert_to_ndarray(train)
+    starts = np.asarray(starts, dtype='float64')
+    if starts.size == 0:
+        return np.zeros((0, nbins))
+    _x = np.linspace(starts+roi[0], starts+roi[1], nbins, axis=1)
+
+    if method == 'binned':
+        if not hasattr(k, 'support'):
+            raise ValueError("binned method requires a kernel from kernel()")
+        if resolution is None:
+            resolution = (roi[1] - roi[0]) / max(nbins - 1, 1)
+        _mean_response = _binned_linear_filter(target, k, _x.ravel(), resolution)
+    elif method == 'exact' and hasattr(k, 'support') and np.all(np.isfinite(k.support)):
+        _mean_response = _windowed_linear_filter(target, k, _x)
+    elif method == 'exact':
+        _mean_response = np.array(list(map(generate_linear_filter(target, k), _x.ravel())))
+    else:
+        raise ValueError("unknown method: "+str(method))
 
-        if pbar:
-            pbar.update(1)
+    if pbar:
+        pbar.update(len(starts))
 
-    return _mean_response
+    return _mean_response.reshape((len(starts), nbins))
@@ -126,7 +126,8 @@ your own ```mark_chunker``` function, which returns a tuple:
 
 def import_spike_train_data(session, mouse_id, mat, csv='',
                             data_dir='data/', mat_marker_channel='DIG01',
-                            csv_chunker=None, chunker_args={'skip':["START", "QUIT"]}):
+                            csv_chunker=None, chunker_args={'skip':["START", "QUIT"]},
+                            cache_dir=None, cache_size=2**32):
     """Import .mat and .csv data.
 
 Args:
@@ -137,11 +138,19 @@ Args:
     - data_dir:   data directory path. [optional, default: data/]
     - mat_marker_channel: the marker channel name in .mat file. [optional, default: DIG01]
     - csv_chunker: custom csv chunker function [optional, default: None]
+    - cache_dir:  directory of an on-disk cache of the parsed data, see
+                  `session_store.cached_import`. [optional, default: None, no cache]
+    - cache_size: size limit of the cache in bytes. [optional, default: 4 GB]
 
 Returns:
     - spike_trains:   dict{channel_name: SpikeUnit}
     - spike_marker:   SpikeMarker
     """
+    if cache_dir is not None:
+        from .session_store import cached_import
+        return cached_import(cache_dir, session, mouse_id, mat, csv, data_dir, mat_marker_channel,
+                             csv_chunker, chunker_args, cache_size)
+
     _mat_file = os.path.join(data_dir, mat)
 
     _spike_marker_raw = None
@@ -156,9 +165,9 @@ Returns:
         with h5py.File(_mat_file,"r") as f: # for v7 mat file
             for channel in f.keys():
                 if channel == mat_marker_channel:
-                    _spike_marker_raw = f.get(channel)['times'].value[0]
+                    _spike_marker_raw = f.get(channel)['times'][()][0]
                 else:
-                    _spike_trains_raw[channel] = f.get(channel)['times'].value[0]
+                    _spike_trains_raw[channel] = f.get(channel)['times'][()][0]
     except OSError:
         # for v4 v5 v6 mat file
         _raw_data = scipy.io.loadmat(_mat_file)
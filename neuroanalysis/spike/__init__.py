@@ -1,8 +1,10 @@
-from .single_unit import PSTH
-from .multi_unit import crosscorrelogram
+from .single_unit import PSTH, segment_train, batch_psth
+from .multi_unit import crosscorrelogram, correlogram, crosscorrelogram_matrix
 
 ##### #####
 from .SpikeUnit import SpikeUnit, SpikeMarker, import_spike_train_data
+from .session_store import pack_session, load_session, convert_session
+from .batch import run_batch
 from .FilterKernel import generate_linear_filter, apply_linear_filter
 from .FilterKernel import kernel, apply_linear_filter_withroi
 from .SpikeVisualization import plot_curve_with_error_ribbon
@@ -12,7 +14,9 @@ from .orientation_selectivity import calc_gOSI, calc_gDSI
 from .tools import *
 
 __all__ = [
-    'import_spike_train_data', 'kernel', 
+    'import_spike_train_data', 'kernel', 'segment_train', 'batch_psth', 'correlogram',
+    'crosscorrelogram_matrix', 'pack_session', 'load_session', 'convert_session',
+    'run_batch',
     'generate_linear_filter', 'apply_linear_filter', 'apply_linear_filter_withroi',
     'plot_curve_with_error_ribbon', 'calc_gOSI', 'calc_gDSI'
 ]
@@ -0,0 +1,136 @@
+import traceback
+import pandas as pd
+import h5py
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from .SpikeUnit import import_spike_train_data
+
+
+def _read_manifest(manifest):
+    if isinstance(manifest, str):
+        manifest = pd.read_csv(manifest, keep_default_na=False, dtype=str)
+    if isinstance(manifest, pd.DataFrame):
+        manifest = manifest.to_dict('records')
+    _entries = [dict(each) for each in manifest]
+    _sessions = [str(each['session']) for each in _entries]
+    if len(set(_sessions)) != len(_sessions):
+        raise ValueError("sessions in the manifest are not unique.")
+    return _entries
+
+
+def _run_session(analysis, entry, data_dir, import_kwargs):
+    """import and analyse one session, in a worker process."""
+    spike_trains, spike_marker = import_spike_train_data(
+        entry['session'], entry['mouse_id'], entry['mat'], entry.get('csv', ''),
+        data_dir=data_dir, **import_kwargs)
+    return analysis(spike_trains, spike_marker)
+
+
+def _write_result(group, result):
+    if not isinstance(result, dict):
+        result = {'result': result}
+    for key, val in result.items():
+        if isinstance(val, dict):
+            _write_result(group.create_group(str(key)), val)
+        elif val is not None:
+            group.create_dataset(str(key), data=val)
+
+
+def run_batch(manifest, analysis, filename, data_dir='data/', n_jobs=1, pbar=None,
+              **import_kwargs):
+    """
+    import and analyse many sessions, saving the results into one hdf5 file.
+
+    each session is imported with `import_spike_train_data` and passed to
+    `analysis`; its result is written to the group `/<session>` as soon as
+    the session finishes, and the group is marked complete once written.
+    sessions already complete in `filename` are skipped, so a batch that
+    crashed or was interrupted resumes where it stopped. a session that
+    raises is reported and left incomplete, to be retried on the next run.
+
+    arguments:
+    - manifest: sessions as a list of dict, a pandas.DataFrame or the path
+                of a .csv file, with the fields `session`, `mouse_id`,
+                `mat` and optionally `csv`
+    - analysis: function(spike_trains, spike_marker) returning a dict of
+                arrays (nested dicts are written as subgroups) or a single
+                array; with n_jobs > 1 it should be picklable, i.e.
+                defined at the module level
+    - filename: output hdf5 file, appended to if it exists
+
+    keyword arguments:
+    - data_dir: data directory of the .mat and .csv files [default: data/]
+    - n_jobs: number of processes, at most 2*n_jobs sessions are in flight
+              [default: 1, no process pool]
+    - pbar: progress bar in tqdm, updated by each session [default: None]
+    - import_kwargs: passed to `import_spike_train_data`, e.g. `cache_dir`
+
+    return:
+    - dict{session: status}, status is 'done', 'skipped' or the traceback
+      of the failed session
+    """
+    _entries = _read_manifest(manifest)
+    _status = {}
+
+    with h5py.File(filename, 'a') as _h5file:
+        _todo = []
+        for each in _entries:
+            _session = str(each['session'])
+            if _session in _h5file:
+                if _h5file[_session].attrs.get('complete', False):
+                    _status[_session] = 'skipped'
+                    if pbar is not None:
+                        pbar.update(1)
+                    continue
+                del _h5file[_session]  # partially written
+            _todo.append(each)
+
+        def _finish(entry, result=None, error=None):
+            _session = str(entry['session'])
+            if error is not None:
+                _status[_session] = error
+            else:
+                _group = _h5file.create_group(_session)
+                _group.attrs['mouse_id'] = str(entry['mouse_id'])
+                try:
+                    _write_result(_group, result)
+                except Exception:
+                    del _h5file[_session]
+                    _status[_session] = traceback.format_exc()
+                else:
+                    _group.attrs['complete'] = True
+                    _status[_session] = 'done'
+                _h5file.flush()
+            if pbar is not None:
+                pbar.update(1)
+
+        if n_jobs > 1:
+            with ProcessPoolExecutor(n_jobs) as _pool:
+                _pending = {}
+                _queue = iter(_todo)
+                while True:
+                    for each in _queue:
+                        _pending[_pool.submit(_run_session, analysis, each, data_dir,
+                                              import_kwargs)] = each
+                        if len(_pending) >= 2 * n_jobs:
+                            break
+                    if not _pending:
+                        break
+                    _done, _ = wait(_pending, return_when=FIRST_COMPLETED)
+                    for _future in _done:
+                        _entry = _pending.pop(_future)
+                        try:
+                            _result = _future.result()
+                        except Exception:
+                            _finish(_entry, error=traceback.format_exc())
+                        else:
+                            _finish(_entry, _result)
+        else:
+            for each in _todo:
+                try:
+                    _result = _run_session(analysis, each, data_dir, import_kwargs)
+                except Exception:
+                    _finish(each, error=traceback.format_exc())
+                else:
+                    _finish(each, _result)
+
+    return _status
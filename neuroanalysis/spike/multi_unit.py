@@ -1,6 +1,9 @@
 import numpy as np
 import matplotlib.pyplot as plt
-from .single_unit import PSTH
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+from .single_unit import _segment_index
+from .SpikeUnit import SpikeUnit
 
 
 def shiftappend(arr, shift, end=None, direction='left'):
@@ -14,6 +17,69 @@ def shiftappend(arr, shift, end=None, direction='left'):
     else:
         raise ValueError('unknown direction: %s'%direction)
 
+def correlogram(target, reference, ROI=(-0.5,0.5), binsize=.01, shift=None):
+    """
+    Raw crosscorrelogram and shift predictor, with every shift in one pass.
+    
+    the reference train and all its shifted copies are stacked as one
+    marker array; the lag window of each reference spike is located by
+    binary search on the sorted target train, and all lags are binned
+    at once, labeled by the shift they belong to.
+    
+    arguments:
+    - target: the target spike train as 1d numpy.array
+    - reference: the reference spike train as 1d numpy.array
+    
+    keyword arguments:
+    - ROI: region of interest as tuple [default: (-0.5, 0.5)]
+    - binsize: the size of each bin [default: 0.01]
+    - shift: shift size or list of shift sizes, if None then skip the
+             shift predictor [default: None]
+    
+    return:
+    (raw, predictor)
+    - raw: crosscorrelogram without correction, as in 1d numpy.array
+    - predictor: shift predictor averaged over shifts, as in 1d numpy.array,
+                 or None if no shift is given
+    """
+    target = np.asarray(target)
+    if np.any(target[1:] < target[:-1]):
+        target = np.sort(target)
+    reference = np.asarray(reference)
+    _bins = int((ROI[-1]-ROI[0])/binsize)
+    
+    if isinstance(shift, int) or isinstance(shift, float):
+        _shifts = [shift]
+    elif isinstance(shift, list) or isinstance(shift, np.ndarray):
+        _shifts = list(shift)
+    else:
+        _shifts = []
+    
+    _refs = [reference] + [shiftappend(reference, item) for item in _shifts]
+    _nrefs = np.array([np.size(each) for each in _refs])
+    _markers = np.concatenate(_refs)
+    _labels = np.repeat(np.arange(len(_refs)), _nrefs)
+    
+    _offsets, _idx = _segment_index(target, _markers, ROI)
+    _count = np.diff(_offsets)
+    _lags = target[_idx] - np.repeat(_markers, _count)
+    _hist, _, _ = np.histogram2d(np.repeat(_labels, _count), _lags,
+                                 bins=[len(_refs), _bins],
+                                 range=[(-0.5, len(_refs)-0.5), ROI])
+    _hist = _hist/_nrefs[:, None]/binsize
+    
+    if isinstance(shift, int) or isinstance(shift, float):
+        _predictor = _hist[1]
+    elif _shifts:
+        _predictor = np.zeros(_bins)
+        for item in _hist[1:]:
+            _predictor = _predictor + item/np.size(shift)
+    else:
+        _predictor = None
+    
+    return _hist[0], _predictor
+
+
 def crosscorrelogram(target, reference, ROI=(-0.5,0.5), binsize=.01, shift=None, skip_plot=False):
     """
     Cross Correlation between two unit, optionally corrected by shift predictor.
@@ -32,22 +98,10 @@ def crosscorrelogram(target, reference, ROI=(-0.5,0.5), binsize=.01, shift=None,
     - crosscorrelogram: as in 1d numpy.array
     """
     
-    _xcorr, _ = PSTH(target, reference, ROI, binsize, True)
+    _xcorr, _xcorr_shift = correlogram(target, reference, ROI, binsize, shift)
     
-    if isinstance(shift, int) or isinstance(shift, float):
-        _shift_reference = shiftappend(reference, shift)
-        _xcorr_shift, _ = PSTH(target, _shift_reference, ROI, binsize, True)
+    if not isinstance(_xcorr_shift, type(None)):
         _xcorr = _xcorr - _xcorr_shift
-        
-    elif isinstance(shift, list) or isinstance(shift, np.ndarray):
-        _xcorr_shift = np.zeros_like(_xcorr)
-        for item in shift:
-            _shift_reference = shiftappend(reference, item)
-            _xcorr_shift_item, _ = PSTH(target, _shift_reference, ROI, binsize, True)
-            _xcorr_shift = _xcorr_shift + _xcorr_shift_item/np.size(shift)
-        _xcorr = _xcorr - _xcorr_shift
-    else:
-        _xcorr_shift = None
 
     if not skip_plot:
         plt.figure(figsize=(16,4))
@@ -67,4 +121,118 @@ def crosscorrelogram(target, reference, ROI=(-0.5,0.5), binsize=.01, shift=None,
         
         plt.show()
 
-    return _xcorr
\ No newline at end of file
+    return _xcorr
+
+
+def _mirrored_correlogram(target, reference, ROI, binsize):
+    """
+    raw crosscorrelograms of (target, reference) and (reference, target),
+    from the lags of a single pass, for a symmetric ROI.
+    
+    the lags are gathered in a window one bin wider than ROI, then each
+    direction keeps the spikes inside its own open window, compared as
+    `crosscorrelogram` does, and bins its own lags, so spikes on a bin
+    edge fall in the same bin as with two separate calls.
+    """
+    _bins = int((ROI[-1]-ROI[0])/binsize)
+    _offsets, _idx = _segment_index(target, reference, (ROI[0]-binsize, ROI[-1]+binsize))
+    _t = target[_idx]
+    _r = np.repeat(reference, np.diff(_offsets))
+    _lags = _t - _r
+    
+    _result = []
+    for _lag, _inside, _nrefs in [(_lags, (_t > _r+ROI[0]) & (_t < _r+ROI[-1]), np.size(reference)),
+                                  (-_lags, (_r > _t+ROI[0]) & (_r < _t+ROI[-1]), np.size(target))]:
+        _hist, _, _ = np.histogram2d(np.zeros(np.count_nonzero(_inside)), _lag[_inside],
+                                     bins=[1, _bins], range=[(-0.5, 0.5), ROI])
+        _result.append(_hist[0]/_nrefs/binsize)
+    return _result
+
+
+def _correlogram_pairs(trains, pairs, ROI, binsize, shift, mirror=False):
+    """
+    corrected crosscorrelogram of each (target, reference) index pair,
+    as (n_pairs, 2, n_bins); with `mirror`, [:, 1] is the (reference,
+    target) crosscorrelogram.
+    """
+    _result = np.zeros((len(pairs), 2, int((ROI[-1]-ROI[0])/binsize)))
+    for _k, (_i, _j) in enumerate(pairs):
+        if mirror:
+            _result[_k] = _mirrored_correlogram(trains[_i], trains[_j], ROI, binsize)
+            continue
+        _raw, _predictor = correlogram(trains[_i], trains[_j], ROI, binsize, shift)
+        _result[_k, 0] = _raw if isinstance(_predictor, type(None)) else _raw - _predictor
+    return _result
+
+
+def crosscorrelogram_matrix(units, ROI=(-0.5,0.5), binsize=.01, shift=None,
+                            n_jobs=1, filename=None):
+    """
+    Crosscorrelogram of every unit pair.
+    
+    the entry [i, j] is `crosscorrelogram(units[i], units[j], ...)`, i.e.
+    unit i as the target and unit j as the reference.
+    
+    without shift predictor and with a symmetric ROI, only the pairs
+    i <= j are computed; the lags of each such pass are binned for
+    both [i, j] and [j, i]. otherwise every ordered pair is computed.
+    
+    arguments:
+    - units: list of SpikeUnit or 1d numpy.array, or dict of them as
+             returned by `import_spike_train_data`
+    
+    keyword arguments:
+    - ROI: region of interest as tuple [default: (-0.5, 0.5)]
+    - binsize: the size of each bin [default: 0.01]
+    - shift: shift size or list of shift sizes for the shift predictor
+             correction, as in `crosscorrelogram` [default: None]
+    - n_jobs: number of processes the pairs are spread over [default: 1]
+    - filename: if given, the result is written into a .npy memmap of
+                this path instead of an in-memory array [default: None]
+    
+    return:
+    - (n_units, n_units, n_bins) numpy.array or numpy.memmap
+    """
+    if isinstance(units, dict):
+        units = list(units.values())
+    _trains = [np.sort(each.spike_train if isinstance(each, SpikeUnit) else each)
+               for each in units]
+    _n = len(_trains)
+    _bins = int((ROI[-1]-ROI[0])/binsize)
+    
+    _symmetric = isinstance(shift, type(None)) and np.isclose(ROI[0], -ROI[-1])
+    if _symmetric:
+        _pairs = [(i, j) for i in range(_n) for j in range(i, _n)]
+    else:
+        _pairs = [(i, j) for i in range(_n) for j in range(_n)]
+    
+    if filename:
+        _result = np.lib.format.open_memmap(filename, mode='w+', dtype='float64',
+                                            shape=(_n, _n, _bins))
+    else:
+        _result = np.zeros((_n, _n, _bins))
+    
+    _blocks = [each for each in np.array_split(np.arange(len(_pairs)), max(n_jobs, 1)*4) if len(each)]
+    _block_pairs = [[_pairs[idx] for idx in each] for each in _blocks]
+    if n_jobs > 1:
+        _pool = ProcessPoolExecutor(n_jobs)
+        _results = _pool.map(_correlogram_pairs, repeat(_trains), _block_pairs,
+                             repeat(ROI), repeat(binsize), repeat(shift), repeat(_symmetric))
+    else:
+        _pool = None
+        _results = map(_correlogram_pairs, repeat(_trains), _block_pairs,
+                       repeat(ROI), repeat(binsize), repeat(shift), repeat(_symmetric))
+    
+    try:
+        for _pair_list, _values in zip(_block_pairs, _results):
+            for (_i, _j), _value in zip(_pair_list, _values):
+                _result[_i, _j] = _value[0]
+                if _symmetric and _i != _j:
+                    _result[_j, _i] = _value[1]
+    finally:
+        if _pool:
+            _pool.shutdown()
+    
+    if filename:
+        _result.flush()
+    return _result
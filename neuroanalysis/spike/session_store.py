@@ -0,0 +1,344 @@
+#!/usr/bin/env python3
+"""Packed session format.
+
+A packed session is a directory of .npy files, which are memory-mapped
+on load, and a small json header:
+
+- spike_times.npy:   all spike trains concatenated, float64.
+- spike_offsets.npy: int64 offsets of each unit, unit i is
+                     spike_times[offsets[i]:offsets[i+1]].
+- marker_train.npy:  marker times recorded in the .mat file.
+- chunk_times.npy, chunk_offsets.npy: the chunked markers of each
+                     condition, concatenated in the same way.
+- raw_table_<i>.npy, table_<i>.npy: columns of the .csv marker table and
+                     of the chunked marker table, with a
+                     <name>_<i>_na.npy mask for missing values in text
+                     columns.
+- session.json:      session, mouse id, channel, column and condition names.
+
+Packed sessions also back the on-disk cache of `import_spike_train_data`,
+see `cached_import`.
+"""
+
+import functools
+import hashlib
+import json
+import os
+import shutil
+import types
+import numpy as np
+import pandas as pd
+from .SpikeUnit import SpikeUnit, SpikeMarker, import_spike_train_data
+
+_VERSION = 1
+
+
+def _concatenate(arrays):
+    offsets = np.zeros(len(arrays) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([np.size(each) for each in arrays])
+    values = np.concatenate([np.asarray(each, dtype=np.float64).ravel() for each in arrays]) \
+        if arrays else np.zeros(0)
+    return values, offsets
+
+
+def _split(values, offsets):
+    return [values[offsets[i]:offsets[i+1]] for i in range(len(offsets) - 1)]
+
+
+def _save_table(dirname, prefix, table):
+    if table is None:
+        return None
+    columns = []
+    for i, name in enumerate(table.columns):
+        column = table[name]
+        if pd.api.types.is_numeric_dtype(column.dtype):
+            np.save(os.path.join(dirname, '%s_%d.npy' % (prefix, i)), column.to_numpy())
+        else:
+            missing = column.isna().to_numpy()
+            np.save(os.path.join(dirname, '%s_%d.npy' % (prefix, i)),
+                    np.asarray(column.where(~missing, '').astype(str), dtype=str))
+            if missing.any():
+                np.save(os.path.join(dirname, '%s_%d_na.npy' % (prefix, i)), missing)
+        columns.append(name)
+    return columns
+
+
+def _load_table(dirname, prefix, columns, mmap_mode):
+    if columns is None:
+        return None
+    table = {}
+    for i, name in enumerate(columns):
+        column = np.load(os.path.join(dirname, '%s_%d.npy' % (prefix, i)), mmap_mode=mmap_mode)
+        if column.dtype.kind == 'U':
+            column = column.astype(object)
+            _na = os.path.join(dirname, '%s_%d_na.npy' % (prefix, i))
+            if os.path.exists(_na):
+                column[np.load(_na)] = np.nan
+        table[name] = column
+    return pd.DataFrame(table, columns=columns)
+
+
+def pack_session(filename, spike_trains, spike_marker):
+    """Write the units and markers of a session as a packed session.
+
+The directory is written next to `filename` and moved in place at the
+end, so an interrupted write never leaves a partial session behind.
+
+Args:
+    - filename:     directory of the packed session.
+    - spike_trains: dict{channel_name: SpikeUnit}
+    - spike_marker: SpikeMarker
+
+Returns:
+    - filename
+    """
+    _tmp = filename.rstrip(os.sep) + '.tmp%d' % os.getpid()
+    if os.path.exists(_tmp):
+        shutil.rmtree(_tmp)
+    os.makedirs(_tmp)
+
+    _channels = list(spike_trains)
+    _times, _offsets = _concatenate([spike_trains[each].spike_train for each in _channels])
+    np.save(os.path.join(_tmp, 'spike_times.npy'), _times)
+    np.save(os.path.join(_tmp, 'spike_offsets.npy'), _offsets)
+
+    _conditions = list(spike_marker.chunked_marker)
+    _chunks, _chunk_offsets = _concatenate([spike_marker.chunked_marker[each] for each in _conditions])
+    np.save(os.path.join(_tmp, 'chunk_times.npy'), _chunks)
+    np.save(os.path.join(_tmp, 'chunk_offsets.npy'), _chunk_offsets)
+    np.save(os.path.join(_tmp, 'marker_train.npy'), np.asarray(spike_marker._raw_train, dtype=np.float64))
+
+    _header = {
+        'version': _VERSION,
+        'session': spike_marker.session,
+        'mouse_id': spike_marker.mouse_id,
+        'channels': _channels,
+        'conditions': [each.item() if isinstance(each, np.generic) else each for each in _conditions],
+        'raw_table': _save_table(_tmp, 'raw_table', spike_marker._raw_table),
+        'table': _save_table(_tmp, 'table', spike_marker.table_marker),
+    }
+    with open(os.path.join(_tmp, 'session.json'), 'w') as f:
+        json.dump(_header, f)
+
+    if os.path.exists(filename):
+        shutil.rmtree(filename)
+    os.replace(_tmp, filename)
+    return filename
+
+
+def load_session(filename, mmap=True):
+    """Load a packed session.
+
+The spike trains and chunked markers are views into the memory-mapped
+columns, nothing is parsed and only the pages used are read.
+
+Args:
+    - filename: directory of the packed session.
+    - mmap:     memory-map the arrays, otherwise read them in memory.
+                [optional, default: True]
+
+Returns:
+    - spike_trains:   dict{channel_name: SpikeUnit}
+    - spike_marker:   SpikeMarker
+    """
+    _mode = 'r' if mmap else None
+    with open(os.path.join(filename, 'session.json')) as f:
+        _header = json.load(f)
+    if _header.get('version') != _VERSION:
+        raise ValueError("unknown packed session version: %s" % _header.get('version'))
+    _load = lambda name: np.load(os.path.join(filename, name), mmap_mode=_mode)
+
+    _trains = _split(_load('spike_times.npy'), _load('spike_offsets.npy'))
+    spike_trains = {}
+    for (channel, train) in zip(_header['channels'], _trains):
+        spike_trains[channel] = SpikeUnit(_header['session'], _header['mouse_id'], channel, train)
+
+    _chunked = dict(zip(_header['conditions'],
+                        _split(_load('chunk_times.npy'), _load('chunk_offsets.npy'))))
+    _table = _load_table(filename, 'table', _header['table'], _mode)
+    spike_marker = SpikeMarker(_header['session'], _header['mouse_id'],
+                               _load_table(filename, 'raw_table', _header['raw_table'], _mode),
+                               _load('marker_train.npy'),
+                               mark_chunker=lambda table, train: (_table, _chunked))
+    return spike_trains, spike_marker
+
+
+def convert_session(filename, session, mouse_id, mat, csv='', data_dir='data/', **kwargs):
+    """Import .mat and .csv data and write them as a packed session.
+
+Args:
+    - filename: directory of the packed session.
+    - session, mouse_id, mat, csv, data_dir, kwargs: as in
+      `import_spike_train_data`.
+
+Returns:
+    - spike_trains:   dict{channel_name: SpikeUnit}
+    - spike_marker:   SpikeMarker
+    """
+    spike_trains, spike_marker = import_spike_train_data(session, mouse_id, mat, csv,
+                                                         data_dir=data_dir, **kwargs)
+    pack_session(filename, spike_trains, spike_marker)
+    return spike_trains, spike_marker
+
+
+class _Unkeyable(Exception):
+    """a chunker or argument whose content cannot be keyed reliably."""
+
+
+def _frame_key(frame):
+    _rows = pd.util.hash_pandas_object(frame, index=True).to_numpy()
+    return [type(frame).__name__, repr(list(getattr(frame, 'columns', [frame.name]))),
+            hashlib.sha1(_rows.tobytes()).hexdigest()]
+
+
+def _source_key(path):
+    if isinstance(path, pd.DataFrame):
+        return _frame_key(path)
+    if not path:
+        return None
+    _stat = os.stat(path)
+    return [os.path.abspath(path), _stat.st_size, _stat.st_mtime_ns]
+
+
+def _value_key(val, seen):
+    """content key of a chunker argument, constant or captured value."""
+    if val is None or isinstance(val, (bool, int, float, complex, str, bytes, np.generic)):
+        return repr(val)
+    if isinstance(val, (tuple, list)):
+        return [type(val).__name__, [_value_key(each, seen) for each in val]]
+    if isinstance(val, (set, frozenset)):
+        return [type(val).__name__, sorted(json.dumps(_value_key(each, seen)) for each in val)]
+    if isinstance(val, dict):
+        return ['dict', sorted([json.dumps(_value_key(key, seen)), _value_key(each, seen)]
+                               for key, each in val.items())]
+    if isinstance(val, np.ndarray) and val.dtype != object:
+        return ['ndarray', val.dtype.str, val.shape,
+                hashlib.sha1(np.ascontiguousarray(val).tobytes()).hexdigest()]
+    if isinstance(val, (pd.DataFrame, pd.Series)):
+        return _frame_key(val)
+    if isinstance(val, types.ModuleType):
+        return ['module', val.__name__]
+    if isinstance(val, type):
+        return ['type', val.__module__, val.__qualname__]
+    if isinstance(val, types.CodeType):
+        return _code_key(val, seen)
+    if isinstance(val, functools.partial):
+        return ['partial', _value_key(val.func, seen), _value_key(val.args, seen),
+                _value_key(val.keywords, seen)]
+    if isinstance(val, types.FunctionType):
+        return _function_key(val, seen)
+    if isinstance(val, types.BuiltinFunctionType):
+        return ['builtin', getattr(val, '__module__', None), val.__qualname__]
+    raise _Unkeyable(repr(type(val)))
+
+
+def _code_key(code, seen):
+    return ['code', hashlib.sha1(code.co_code).hexdigest(), code.co_names,
+            [_value_key(each, seen) for each in code.co_consts]]
+
+
+def _global_names(code):
+    _names = set(code.co_names)
+    for each in code.co_consts:
+        if isinstance(each, types.CodeType):
+            _names |= _global_names(each)
+    return _names
+
+
+def _function_key(func, seen=None):
+    """
+key of a chunker from its bytecode, constants, defaults, closure values
+and the globals it refers to, so chunkers differing in any of them get
+different entries.
+    """
+    if func is None:
+        return None
+    seen = set() if seen is None else seen
+    if id(func) in seen:
+        return ['recursive', func.__qualname__]
+    seen.add(id(func))
+    if not isinstance(func, types.FunctionType):
+        return _value_key(func, seen)
+    _code = func.__code__
+    _closure = [_value_key(each.cell_contents, seen) for each in (func.__closure__ or ())]
+    _globals = [[name, _value_key(func.__globals__[name], seen)]
+                for name in sorted(_global_names(_code)) if name in func.__globals__]
+    return ['function', func.__module__, func.__qualname__, _code_key(_code, seen),
+            _value_key(func.__defaults__, seen), _value_key(func.__kwdefaults__, seen),
+            _closure, _globals]
+
+
+def _entry_size(entry):
+    return sum(os.path.getsize(os.path.join(entry, each)) for each in os.listdir(entry))
+
+
+def _evict(cache_dir, cache_size, keep):
+    _entries = []
+    for name in os.listdir(cache_dir):
+        _header = os.path.join(cache_dir, name, 'session.json')
+        if '.tmp' in name or not os.path.exists(_header):
+            continue
+        _entries.append((os.path.getmtime(_header), name, _entry_size(os.path.join(cache_dir, name))))
+    _total = sum(each[2] for each in _entries)
+    # least recently used first
+    for (_, name, size) in sorted(_entries):
+        if _total <= cache_size:
+            break
+        if name == keep:
+            continue
+        shutil.rmtree(os.path.join(cache_dir, name), ignore_errors=True)
+        _total -= size
+
+
+def cached_import(cache_dir, session, mouse_id, mat, csv='', data_dir='data/',
+                  mat_marker_channel='DIG01', csv_chunker=None,
+                  chunker_args={'skip':["START", "QUIT"]}, cache_size=2**32):
+    """`import_spike_train_data` through an on-disk cache of packed sessions.
+
+Entries are keyed by the path, size and modification time of the .mat
+and .csv files, the marker channel and the chunker with its arguments,
+so a changed source is simply a different entry. A custom chunker is
+keyed by its code, constants, defaults, closure values and the globals
+it uses; if any of them is of a type whose content cannot be hashed,
+the import bypasses the cache. A hit memory-maps the
+packed session. The cache keeps at most `cache_size` bytes, evicting the
+least recently used entries.
+
+Args:
+    - cache_dir:  cache directory, created if missing.
+    - cache_size: size limit of the cache in bytes. [optional, default: 4 GB]
+    - others:     as in `import_spike_train_data`.
+
+Returns:
+    - spike_trains:   dict{channel_name: SpikeUnit}
+    - spike_marker:   SpikeMarker
+    """
+    _mat_file = os.path.join(data_dir, mat)
+    _csv = csv if isinstance(csv, pd.DataFrame) or not csv else os.path.join(data_dir, csv)
+    try:
+        _key = json.dumps([_VERSION, session, mouse_id, _source_key(_mat_file), _source_key(_csv),
+                           mat_marker_channel, _function_key(csv_chunker),
+                           _value_key(chunker_args, set())])
+    except _Unkeyable:
+        # a chunker capturing values of unknown content is never cached
+        return import_spike_train_data(
+            session, mouse_id, mat, csv, data_dir=data_dir, mat_marker_channel=mat_marker_channel,
+            csv_chunker=csv_chunker, chunker_args=chunker_args)
+    _name = hashlib.sha1(_key.encode()).hexdigest()
+    _entry = os.path.join(cache_dir, _name)
+
+    if os.path.exists(os.path.join(_entry, 'session.json')):
+        try:
+            result = load_session(_entry)
+            os.utime(os.path.join(_entry, 'session.json'))
+            return result
+        except (OSError, ValueError, KeyError):
+            shutil.rmtree(_entry, ignore_errors=True)
+
+    spike_trains, spike_marker = import_spike_train_data(
+        session, mouse_id, mat, csv, data_dir=data_dir, mat_marker_channel=mat_marker_channel,
+        csv_chunker=csv_chunker, chunker_args=chunker_args)
+    os.makedirs(cache_dir, exist_ok=True)
+    pack_session(_entry, spike_trains, spike_marker)
+    _evict(cache_dir, cache_size, keep=_name)
+    return load_session(_entry)
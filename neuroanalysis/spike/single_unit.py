@@ -1,5 +1,57 @@
 import numpy as np
 import matplotlib.pyplot as plt
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+from .SpikeUnit import SpikeUnit, SpikeMarker
+
+
+def _segment_index(train, marker, ROI):
+    """offsets of each trial and the index of its spikes in the sorted train."""
+    _lo = np.searchsorted(train, marker+ROI[0], side='right')
+    _hi = np.searchsorted(train, marker+ROI[-1], side='left')
+    _count = np.maximum(_hi - _lo, 0)
+    
+    _offsets = np.zeros(np.size(marker)+1, dtype='int')
+    np.cumsum(_count, out=_offsets[1:])
+    _idx = np.arange(_offsets[-1]) - np.repeat(_offsets[:-1] - _lo, _count)
+    return _offsets, _idx
+
+
+def segment_train(train, marker, ROI):
+    """
+    spike times relative to each marker, within the region of interest.
+    
+    the window of each marker is located by binary search on the sorted
+    train, so the cost is O(n_markers * log(n_spikes) + n_selected)
+    instead of masking the whole train for every marker.
+    
+    arguments:
+    - train: the spike train as 1d numpy.array, searched through its
+             sorting order if unsorted
+    - marker: the marker of stimuli
+    - ROI: the region of interest for each stimuli
+    
+    return:
+    (offsets, values)
+    - offsets: 1d int array of size `n_markers + 1`
+    - values: relative spike times of all trials, where the trial `i`
+              is `values[offsets[i]:offsets[i+1]]`, in the order of
+              the train
+    """
+    train = np.asarray(train)
+    marker = np.asarray(marker)
+    
+    if np.any(train[1:] < train[:-1]):
+        _order = np.argsort(train, kind='stable')
+        _offsets, _idx = _segment_index(train[_order], marker, ROI)
+        _trial = np.repeat(np.arange(np.size(marker)), np.diff(_offsets))
+        _idx = _order[_idx]
+        _idx = _idx[np.lexsort((_idx, _trial))]
+    else:
+        _offsets, _idx = _segment_index(train, marker, ROI)
+    _values = train[_idx] - np.repeat(marker, np.diff(_offsets))
+    
+    return _offsets, _values
 
 
 def PSTH(train, marker, ROI, binsize=.1, skip_plot=False):
@@ -23,15 +75,13 @@ def PSTH(train, marker, ROI, binsize=.1, skip_plot=False):
             of the raster plot.
     """
     
-    _seg = []
     _bins = int((ROI[-1]-ROI[0])/binsize)
-    _psth = np.zeros(_bins, dtype='int')
     
-    for _idx, _item in enumerate(marker):
-        _seg_train = train[(_item+ROI[0]<train)&(train<_item+ROI[-1])]-_item
-        _psth_item, _psth_x = np.histogram(_seg_train, range=ROI, bins=_bins)
-        _psth = _psth + _psth_item
-        _seg.append(_seg_train)
+    # all trials are binned at once, the counts are the same as summing
+    # the histogram of each trial.
+    _offsets, _values = segment_train(train, marker, ROI)
+    _psth, _psth_x = np.histogram(_values, range=ROI, bins=_bins)
+    _seg = np.split(_values, _offsets[1:-1]) if np.size(marker) else []
 
     _psth = _psth/np.size(marker)/binsize
     
@@ -52,4 +102,79 @@ def PSTH(train, marker, ROI, binsize=.1, skip_plot=False):
         plt.tight_layout()
         plt.show()
     
-    return _psth, _seg
\ No newline at end of file
+    return _psth, _seg
+
+
+def _batch_psth_counts(trains, markers, ROI, bins):
+    """spike counts of (unit, condition, bin), with one sweep per condition."""
+    _ids = np.repeat(np.arange(len(trains)), [np.size(each) for each in trains])
+    _merged = np.concatenate(trains)
+    _order = np.argsort(_merged, kind='stable')
+    _merged, _ids = _merged[_order], _ids[_order]
+    
+    _counts = np.zeros((len(trains), len(markers), bins), dtype='int')
+    for _cidx, _marker in enumerate(markers):
+        _offsets, _idx = _segment_index(_merged, _marker, ROI)
+        _values = _merged[_idx] - np.repeat(_marker, np.diff(_offsets))
+        _hist, _, _ = np.histogram2d(_ids[_idx], _values, bins=[len(trains), bins],
+                                     range=[(-0.5, len(trains)-0.5), ROI])
+        _counts[:, _cidx, :] = _hist
+    return _counts
+
+
+def batch_psth(units, marker, ROI, binsize=.1, n_jobs=1):
+    """
+    PSTH of many units under many conditions in one call.
+    
+    the spike trains of all units are merged and sorted once, then each
+    condition is a single vectorized sweep over the merged train. each
+    value is the same as `PSTH(train, marker.chunked_marker[cond], ROI, binsize)`.
+    
+    arguments:
+    - units: dict{name: SpikeUnit or 1d numpy.array}, as returned by
+             `import_spike_train_data`, or a list of them
+    - marker: SpikeMarker, or dict{condition: marker array}
+    - ROI: the region of interest for each stimuli
+    
+    keyword arguments:
+    - binsize: the size of each bin [default: 0.1]
+    - n_jobs: number of processes, units are split into n_jobs groups
+              [default: 1, no process pool]
+    
+    return:
+    (PSTH, ntrials, names, conditions)
+    - PSTH: (n_units, n_conditions, n_bins) array of `spike/binsize`
+    - ntrials: number of trials of each condition
+    - names: unit labels of the first axis
+    - conditions: condition labels of the second axis
+    """
+    if isinstance(units, dict):
+        _names = list(units.keys())
+        units = list(units.values())
+    else:
+        _names = [each.channel if isinstance(each, SpikeUnit) else idx
+                  for idx, each in enumerate(units)]
+    _trains = [np.asarray(each.spike_train if isinstance(each, SpikeUnit) else each)
+               for each in units]
+    
+    if isinstance(marker, SpikeMarker):
+        marker = marker.chunked_marker
+    _conditions = list(marker.keys())
+    _markers = [np.asarray(marker[each]) for each in _conditions]
+    _ntrials = np.array([np.size(each) for each in _markers])
+    _bins = int((ROI[-1]-ROI[0])/binsize)
+    
+    if len(_trains) == 0:
+        _counts = np.zeros((0, len(_conditions), _bins), dtype='int')
+    elif n_jobs > 1:
+        _groups = [each for each in np.array_split(np.arange(len(_trains)), n_jobs) if len(each)]
+        with ProcessPoolExecutor(len(_groups)) as _pool:
+            _results = _pool.map(_batch_psth_counts,
+                                 [[_trains[idx] for idx in each] for each in _groups],
+                                 repeat(_markers), repeat(ROI), repeat(_bins))
+            _counts = np.concatenate(list(_results), axis=0)
+    else:
+        _counts = _batch_psth_counts(_trains, _markers, ROI, _bins)
+    
+    _psth = _counts/_ntrials[None, :, None]/binsize
+    return _psth, _ntrials, _names, _conditions
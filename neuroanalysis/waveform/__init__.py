@@ -1,3 +1,6 @@
 from .filter import butter_highpass_filter, bessel_highpass_filter, butter_bandpass_filter
-from .decomposition import dwt, dwt_power, dwt_itpc
-from .misc import create_epoch_bymarker, create_1d_epoch_bymarker
\ No newline at end of file
+from .filter import filter_design, sos_filtfilt, filter_channels
+from .decomposition import dwt, dwt_channels, dwt_power, dwt_itpc, dwt_reduce, normalize_power
+from .decomposition import clear_wavelet_cache
+from .misc import create_epoch_bymarker, create_1d_epoch_bymarker, create_epoch, epoch_starts
+from .misc import detect_cross_pnt, detect_crossings, detect_crossings_stream
\ No newline at end of file
@@ -1,4 +1,8 @@
 import numpy as np
+import scipy.fft as sp_fft
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import threading
 from .filter import gaussianwind
 
 ## wavelet
@@ -9,12 +13,51 @@ def morlet(F, fs):
     wavelet = np.exp(2*1j*np.pi*wtime*F) * np.exp(-wtime**2/(2*s**2))
     return wavelet
 
+# least recently used wavelet spectra, bounded by their total size in bytes
+WAVELET_CACHE_BYTES = 2**28
+_spectra = OrderedDict()
+_spectra_lock = threading.Lock()
+
+def _wavelet_spectrum(wavelet, F, fs, nConv, dtype):
+    """FFT of the wavelet, cached by (wavelet, F, fs, nConv, dtype).
+
+    the cache keeps at most WAVELET_CACHE_BYTES of spectra, dropping the
+    least recently used ones; a spectrum larger than the limit is not kept.
+    """
+    key = (wavelet, F, fs, nConv, np.dtype(dtype))
+    with _spectra_lock:
+        if key in _spectra:
+            _spectra.move_to_end(key)
+            return _spectra[key][0]
+
+    spectrum = sp_fft.fft(wavelet(F, fs), nConv).astype(dtype)
+    spectrum.setflags(write=False)
+    with _spectra_lock:
+        if spectrum.nbytes <= WAVELET_CACHE_BYTES:
+            _spectra[key] = (spectrum, spectrum.nbytes)
+            total = sum(each[1] for each in _spectra.values())
+            while total > WAVELET_CACHE_BYTES:
+                total -= _spectra.popitem(last=False)[1][1]
+    return spectrum
+
+def clear_wavelet_cache():
+    """release the cached wavelet spectra."""
+    with _spectra_lock:
+        _spectra.clear()
+
+
 ## wavelet tranform
-def dwt(data, fs, frange, wavelet=morlet, reflection=False):
+def dwt(data, fs, frange, wavelet=morlet, reflection=False,
+        dtype="complex128", freq_chunk=None, n_jobs=1, out=None):
     """wavelet tranform decomposition.
 
     Syntax: Dwt = dwt(data, fs, frange, wavelet, reflection)
 
+    The wavelet spectra are cached (least recently used first out), and
+    each chunk of frequencies is multiplied into one reused work buffer
+    and inverse transformed in place, so besides the output only a single
+    (freq_chunk, ntrial, nConv) buffer per thread is allocated.
+
     Keyword arguments:
     data       -- (numpy.ndarray) 1D or 2D array. for 2D array, columns as
                   observations, rows as raw data.
@@ -23,6 +66,16 @@ def dwt(data, fs, frange, wavelet=morlet, reflection=False):
     wavelet    -- (function) wavelet function [default: morlet]
     reflection -- (bool) perform data reflection, to compensate the edge effect
                   [default: False]
+    dtype      -- (str) "complex128" or "complex64", the latter computes in
+                  single precision with half of the memory
+                  [default: "complex128"]
+    freq_chunk -- (int) number of frequencies in each batch, None for
+                  one frequency at a time, which is both the fastest and
+                  the smallest [default: None]
+    n_jobs     -- (int) number of threads the frequency batches are spread
+                  over, the FFT releases the GIL [default: 1]
+    out        -- (numpy.ndarray) preallocated (or memory-mapped) output of
+                  shape (nfreq, ntrial, ntime) to write into [default: None]
 
     Return:
     Dwt        -- (numpy.ndarray, dtype="complex") wavelet decomposition result
@@ -32,28 +85,185 @@ def dwt(data, fs, frange, wavelet=morlet, reflection=False):
     if np.ndim(data) == 1:
         data = np.reshape(data, (1, len(data)))
 
+    frange = np.atleast_1d(frange)
+    if out is None:
+        Dwt = np.zeros((np.size(frange), np.size(data, 0), np.size(data, 1)), dtype=dtype)
+    else:
+        Dwt = out
+    def _store(start, conv_wave):
+        Dwt[start:start+len(conv_wave)] = conv_wave
+
+    _dwt_blocks(data, fs, frange, wavelet, reflection, dtype, freq_chunk, n_jobs, _store)
+
+    return Dwt
+
+
+def dwt_channels(data, fs, frange, n_jobs=1, filename=None, **kwargs):
+    """wavelet tranform decomposition of every channel.
+
+    Syntax: Dwt = dwt_channels(data, fs, frange, n_jobs, filename)
+
+    The channels are spread over a thread pool, and each one is written
+    into its slice of a shared output, optionally memory-mapped.
+
+    Keyword arguments:
+    data       -- (numpy.ndarray) 2D (channel, time) or 3D
+                  (channel, trial, time) array
+    fs         -- (int) sampling rate
+    frange     -- (numpy.ndarray) target frequencies
+    n_jobs     -- (int) number of threads [default: 1]
+    filename   -- (str) if given, the output is a .npy memmap of this path
+                  [default: None]
+    **kwargs   -- wavelet, reflection, dtype and freq_chunk, as in dwt
+
+    Return:
+    Dwt        -- (numpy.ndarray) 4D (channel, freq, trial, time) result
+    """
+    if np.ndim(data) == 2:
+        data = np.reshape(data, (np.size(data, 0), 1, np.size(data, 1)))
+
+    frange = np.atleast_1d(frange)
+    shape = (np.size(data, 0), np.size(frange), np.size(data, 1), np.size(data, 2))
+    dtype = kwargs.get('dtype', "complex128")
+    if filename:
+        Dwt = np.lib.format.open_memmap(filename, mode='w+', dtype=dtype, shape=shape)
+    else:
+        Dwt = np.zeros(shape, dtype=dtype)
+
+    def _channel(idx):
+        dwt(data[idx], fs, frange, out=Dwt[idx], **kwargs)
+
+    with ThreadPoolExecutor(max(n_jobs, 1)) as pool:
+        list(pool.map(_channel, range(np.size(data, 0))))
+
+    if filename:
+        Dwt.flush()
+    return Dwt
+
+
+def _dwt_blocks(data, fs, frange, wavelet, reflection, dtype, freq_chunk, n_jobs, sink):
+    """call sink(index of the first frequency, 3D decomposition) for each
+    block of frequencies.
+
+    each thread multiplies the spectra into one preallocated work buffer
+    and runs the inverse FFT in place, so a block costs a single buffer of
+    (freq_chunk, ntrial, nConv); the decomposition passed to sink is a
+    view of that buffer, valid until sink returns. with n_jobs > 1, the
+    blocks are spread over a thread pool and sink is called from the
+    threads, with disjoint frequencies.
+    """
     if reflection:
         data_flip = np.fliplr(data)
         data_fft = np.hstack((data_flip, data, data_flip))
     else:
         data_fft = data
 
-    nConv = np.size(data_fft, -1) + int(2*fs)
-    fft_data = np.fft.fft(data_fft, nConv)
-
-    Dwt = np.zeros((np.size(frange), np.size(data, 0), np.size(data, 1)), dtype="complex")
+    dtype = np.dtype(dtype)
+    real_dtype = "float32" if dtype == np.complex64 else "float64"
 
-    for idx, F in enumerate(frange):
-        fft_wavelet = np.fft.fft(wavelet(F, fs), nConv)
-        conv_wave = np.fft.ifft(fft_wavelet * fft_data, nConv)
-        conv_wave = conv_wave[:, fs:-fs]
+    nConv = np.size(data_fft, -1) + int(2*fs)
+    fft_data = sp_fft.fft(data_fft.astype(real_dtype, copy=False), nConv).astype(dtype, copy=False)
+
+    n_jobs = max(n_jobs, 1)
+    if freq_chunk is None:
+        freq_chunk = 1
+    freq_chunk = max(1, min(freq_chunk, np.size(frange)))
+    local = threading.local()
+
+    def _convolve(start):
+        stop = min(start + freq_chunk, np.size(frange))
+        if not hasattr(local, 'work'):
+            local.work = np.empty((freq_chunk,) + fft_data.shape, dtype=dtype)
+        work = local.work[:stop-start]
+        for idx, F in enumerate(frange[start:stop]):
+            np.multiply(_wavelet_spectrum(wavelet, F, fs, nConv, dtype), fft_data, out=work[idx])
+        conv_wave = sp_fft.ifft(work, axis=-1, overwrite_x=True)[:, :, fs:-fs]
 
         if reflection:
-            Dwt[idx, :, :] = conv_wave[:, np.size(data, 1):-np.size(data, 1)]
+            sink(start, conv_wave[:, :, np.size(data, 1):-np.size(data, 1)])
         else:
-            Dwt[idx, :, :] = conv_wave
+            sink(start, conv_wave)
 
-    return Dwt
+    starts = range(0, np.size(frange), freq_chunk)
+    if n_jobs == 1:
+        for start in starts:
+            _convolve(start)
+        return
+
+    with ThreadPoolExecutor(n_jobs) as pool:
+        list(pool.map(_convolve, starts))
+
+
+def dwt_reduce(data, fs, frange, outputs=('power', 'itpc'), wavelet=morlet,
+               reflection=False, itpcz=False, dtype="complex128",
+               freq_chunk=None, trial_chunk=None, n_jobs=1):
+    """trial-averaged power and inter-trial phase clustering, without the
+    full decomposition.
+
+    Syntax: (Pxx, ITPC) = dwt_reduce(data, fs, frange, outputs)
+
+    The decomposition is computed one block of frequencies and trials at a
+    time, and only the trial sums of |z|^2 and z/|z| are kept, so the peak
+    memory scales with a single block instead of the 3D result of dwt.
+
+    Keyword arguments:
+    data        -- (numpy.ndarray) 1D or 2D array, as in dwt
+    fs          -- (int) sampling rate
+    frange      -- (numpy.ndarray) target frequencies
+    outputs     -- (tuple) any of "power" and "itpc", in the order returned
+                   [default: ("power", "itpc")]
+    wavelet     -- (function) wavelet function [default: morlet]
+    reflection  -- (bool) perform data reflection, as in dwt [default: False]
+    itpcz       -- (bool) return ITPCz instead of ITPC, as in dwt_itpc
+                   [default: False]
+    dtype       -- (str) "complex128" or "complex64" [default: "complex128"]
+    freq_chunk  -- (int) number of frequencies in each block, as in dwt
+                   [default: None, one]
+    trial_chunk -- (int) number of trials in each block, None for about
+                   16 MB per block [default: None]
+    n_jobs      -- (int) number of threads, as in dwt [default: 1]
+
+    Return:
+    tuple of
+    Pxx         -- (numpy.ndarray) raw power averaged across trials, i.e.
+                   the input of normalize_power
+    ITPC        -- (numpy.ndarray) inter-trial phase clustering result
+    """
+    if np.ndim(data) == 1:
+        data = np.reshape(data, (1, len(data)))
+    for each in outputs:
+        if each not in ('power', 'itpc'):
+            raise ValueError("unknown output: %s"%each)
+
+    frange = np.atleast_1d(frange)
+    ntrial = np.size(data, 0)
+    if trial_chunk is None:
+        # about 16 MB of work buffer per block of one frequency
+        nConv = np.size(data, 1) * (3 if reflection else 1) + int(2*fs)
+        trial_chunk = max(1, 2**24 // (np.dtype(dtype).itemsize * nConv))
+
+    power = np.zeros((np.size(frange), np.size(data, 1)))
+    phase = np.zeros((np.size(frange), np.size(data, 1)), dtype="complex")
+    for tstart in range(0, ntrial, trial_chunk):
+        block = data[tstart:tstart+trial_chunk]
+        def _accumulate(start, conv_wave):
+            # conv_wave is a view of the work buffer, normalized in place
+            amplitude = np.square(conv_wave.real)
+            amplitude += np.square(conv_wave.imag)
+            if 'power' in outputs:
+                power[start:start+len(conv_wave)] += np.sum(amplitude, 1)
+            if 'itpc' in outputs:
+                np.sqrt(amplitude, out=amplitude)
+                conv_wave /= amplitude
+                phase[start:start+len(conv_wave)] += np.sum(conv_wave, 1)
+
+        _dwt_blocks(block, fs, frange, wavelet, reflection, dtype, freq_chunk, n_jobs,
+                    _accumulate)
+
+    result = {'power': power / ntrial}
+    ITPC = np.abs(phase / ntrial)
+    result['itpc'] = ITPC**2 * ntrial if itpcz else ITPC
+    return tuple([result[each] for each in outputs])
 
 
 def dwt_power(dwtresult, fs,  zscore=False, baseline=None, gaussian_sigma=0):
@@ -76,7 +286,22 @@ def dwt_power(dwtresult, fs,  zscore=False, baseline=None, gaussian_sigma=0):
 
     # generate power and averaged across tirlas (axis 1)
     raw_pxx = np.mean(np.abs(dwtresult) ** 2.0, 1)
-    
+    return normalize_power(raw_pxx, fs, zscore, baseline, gaussian_sigma)
+
+
+def normalize_power(raw_pxx, fs, zscore=False, baseline=None, gaussian_sigma=0):
+    """normalize the trial-averaged power, from dwt_power or dwt_reduce
+
+    Syntax: Pxx = normalize_power(raw_pxx, fs, zscore, baseline, gaussian_sigma)
+
+    Keyword arguments:
+    raw_pxx   -- (numpy.ndarray) 2D power averaged across trials
+    fs        -- (int) sampling rate
+    zscore, baseline, gaussian_sigma -- as in dwt_power
+
+    Return:
+    Pxx       -- (numpy.ndarray) total power
+    """
     if baseline != None:
         starter = int(baseline[0]*fs)
         gap = int((baseline[1] - baseline[0])*fs)
@@ -96,10 +321,7 @@ def dwt_power(dwtresult, fs,  zscore=False, baseline=None, gaussian_sigma=0):
         Pxx = np.log10(raw_pxx)
         
     if gaussian_sigma > 0:
-        _smooth = np.zeros_like(Pxx)
-        for ridx in range(np.size(Pxx, 0)):
-            _smooth[ridx, :] = gaussianwind(Pxx[ridx, :], fs, gaussian_sigma)
-        Pxx = _smooth
+        Pxx = gaussianwind(Pxx, fs, gaussian_sigma, axis=1)
         
     return Pxx
 
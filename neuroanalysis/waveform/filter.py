@@ -1,41 +1,252 @@
 import scipy.signal as signal
+import scipy.optimize as optimize
 import numpy as np
+import h5py
+import os
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from ..reader.rawdata import AbstractChannel
 
-def _butter_highpass(cutoff, fs, order=5):
+@lru_cache(maxsize=64)
+def _cached_design(kind, order, cutoff, fs, btype):
     nyq = 0.5 * fs
-    normal_cutoff = cutoff / nyq
-    b, a = signal.butter(order, normal_cutoff, btype='high', analog=False)
-    return b, a
-
-
-def butter_highpass_filter(data, cutoff, fs, order=5):
-    b, a = butter_highpass(cutoff, fs, order=order)
-    y = signal.filtfilt(b, a, data)
-    return y
-
-def butter_bandpass_filter(data, bandrange, fs, order=4):
-    b, a = signal.butter(order, [bandrange[0]/fs*2, bandrange[1]/fs*2], 'bandpass')
-    y = signal.filtfilt(b, a, data)
-    return y
-    
-def _bessel_highpass(cutoff, fs, order=5):
-    nyq = 0.5 * fs
-    normal_cutoff = cutoff / nyq
-    b, a = signal.bessel(order, normal_cutoff, btype='highpass')
-    return b, a
+    normal_cutoff = [each / nyq for each in cutoff]
+    if len(normal_cutoff) == 1:
+        normal_cutoff = normal_cutoff[0]
+    if kind == 'butter':
+        sos = signal.butter(order, normal_cutoff, btype=btype, analog=False, output='sos')
+    elif kind == 'bessel':
+        sos = signal.bessel(order, normal_cutoff, btype=btype, output='sos')
+    else:
+        raise ValueError("unknown filter type: %s"%kind)
+    return sos
+
+def filter_design(kind, order, cutoff, fs, btype):
+    """
+    second-order sections of a filter, cached by (kind, order, cutoff, fs, btype).
+
+    arguments:
+    - kind: "butter" or "bessel"
+    - order: filter order
+    - cutoff: cutoff frequency, or (low, high) for band filters
+    - fs: sampling rate
+    - btype: "highpass", "lowpass", "bandpass" or "bandstop"
+
+    returns:
+    - sos: (n_sections, 6) array, shared by the cache, do not modify
+    """
+    cutoff = tuple(float(each) for each in np.atleast_1d(cutoff))
+    return _cached_design(kind, int(order), cutoff, float(fs), btype)
+
+def sos_filtfilt(data, sos, axis=-1, block=None, overlap=0, out=None):
+    """
+    zero-phase forward-backward filtering with second-order sections.
+
+    with `block`, the data are filtered block by block along `axis`, each
+    block extended by `overlap` points on both sides, whose edge effects
+    are discarded. memory is then bounded by the block size, and the data
+    may be memory-mapped or lazy signals, e.g. `CscReader.signal`.
+
+    arguments:
+    - data: nd array, filtered along `axis`
+    - sos: second-order sections, e.g. from `filter_design`
+
+    key arguments:
+    - axis: the time axis [default: -1]
+    - block: number of points of each block, None for the whole array
+             at once [default: None]
+    - overlap: number of points added on both sides of each block,
+               should cover the settling time of the filter [default: 0]
+    - out: preallocated (or memory-mapped) output [default: None]
+
+    returns:
+    - filtered array
+    """
+    if block is None:
+        result = signal.sosfiltfilt(sos, np.asarray(data), axis=axis)
+        if out is None:
+            return result
+        out[...] = result
+        return out
+
+    npnt = data.shape[axis]
+    axis = axis % len(data.shape)
+    if out is None:
+        out = np.zeros(data.shape)
+    head = (slice(None),) * axis
+    for start in range(0, npnt, block):
+        stop = min(start + block, npnt)
+        lo, hi = max(start - overlap, 0), min(stop + overlap, npnt)
+        segment = signal.sosfiltfilt(sos, np.asarray(data[head + (slice(lo, hi),)]), axis=axis)
+        out[head + (slice(start, stop),)] = segment[head + (slice(start - lo, stop - lo),)]
+    return out
+
+def _settle(cutoff, fs, cycles=10):
+    """overlap points covering `cycles` periods of the lowest cutoff."""
+    return int(np.ceil(cycles * fs / np.min(cutoff)))
+
+def butter_highpass_filter(data, cutoff, fs, order=5, axis=-1, block=None):
+    sos = filter_design('butter', order, cutoff, fs, 'highpass')
+    return sos_filtfilt(data, sos, axis, block, _settle(cutoff, fs))
+
+def butter_bandpass_filter(data, bandrange, fs, order=4, axis=-1, block=None):
+    sos = filter_design('butter', order, bandrange, fs, 'bandpass')
+    return sos_filtfilt(data, sos, axis, block, _settle(bandrange, fs))
+
+def bessel_highpass_filter(data, cutoff, fs, order=5, axis=-1, block=None):
+    sos = filter_design('bessel', order, cutoff, fs, 'highpass')
+    return sos_filtfilt(data, sos, axis, block, _settle(cutoff, fs))
+
+def filter_channels(raw_data, channels=None, kind='butter', btype='highpass', cutoff=300,
+                    order=5, n_jobs=1, filename=None, block=2**20):
+    """
+    zero-phase filter the continuous channels of a recording.
+
+    the channels are spread over a thread pool, each one filtered block by
+    block with `sos_filtfilt`, and written into its own output, so the
+    filtered recording never has to fit in memory with `filename` given.
+
+    arguments:
+    - raw_data: RawData, e.g. EDFData loaded with mode="mmap"
 
+    key arguments:
+    - channels: list of channel indices or names, None for all [default: None]
+    - kind, btype, cutoff, order: filter, as in `filter_design`, designed
+                                  at the sampling rate of each channel
+                                  [default: 5th order butter highpass at 300]
+    - n_jobs: number of threads [default: 1]
+    - filename: None to keep the results in memory, a .h5/.hdf5 file to
+                write the datasets "continuous/<name>/value" into, or a
+                directory to write one "<name>.npy" memmap per channel
+                [default: None]
+    - block: number of points filtered at once [default: 2**20]
 
-def bessel_highpass_filter(data, cutoff, fs, order=5):
-    b, a = _bessel_highpass(cutoff, fs, order=order)
-    y = signal.filtfilt(b, a, data)
-    return y
+    returns:
+    - list of AbstractChannel, with the filtered values as ndarray,
+      memmap or h5py dataset (of the file reopened read-only)
+    """
+    if channels is None:
+        channels = range(len(raw_data.continuous_channels))
+    sources = [raw_data.continuous_channels[each] if not isinstance(each, str)
+               else raw_data.getchannel_byname('continuous', each) for each in channels]
 
-def gaussian_kernel(fs, sigma):
-    ktime = np.linspace(-1, 1, int(2 * fs))
-    kernel = 1 / np.sqrt(2*np.pi*sigma**2) * np.exp(-ktime ** 2 / (2 * sigma ** 2))
+    # channels may have different sampling rates, each gets its own
+    # design, which is cached for channels sharing a rate.
+    designs = [(filter_design(kind, order, cutoff, each.frequency, btype),
+                _settle(cutoff, each.frequency)) for each in sources]
+    names = [each.name if each.name != None else '%03d'%idx for idx, each in enumerate(sources)]
+
+    h5file = None
+    if filename and os.path.splitext(filename)[1] in ('.h5', '.hdf5'):
+        h5file = h5py.File(filename, 'w')
+        outputs = [h5file.create_dataset('continuous/%s/value'%name, shape=(len(each.value),),
+                                         dtype='float64', chunks=True)
+                   for name, each in zip(names, sources)]
+    elif filename:
+        os.makedirs(filename, exist_ok=True)
+        outputs = [np.lib.format.open_memmap(os.path.join(filename, '%s.npy'%name), mode='w+',
+                                             dtype='float64', shape=(len(each.value),))
+                   for name, each in zip(names, sources)]
+    else:
+        outputs = [np.zeros(len(each.value)) for each in sources]
+
+    def _filter(idx):
+        sos, overlap = designs[idx]
+        sos_filtfilt(sources[idx].value, sos, block=block, overlap=overlap, out=outputs[idx])
+
+    try:
+        with ThreadPoolExecutor(max(n_jobs, 1)) as pool:
+            list(pool.map(_filter, range(len(sources))))
+    finally:
+        if h5file is not None:
+            h5file.close()
+
+    if h5file is not None:
+        h5file = h5py.File(filename, 'r')
+        outputs = [h5file['continuous/%s/value'%name] for name in names]
+    elif filename:
+        for each in outputs:
+            each.flush()
+
+    return [AbstractChannel(name=each.name, index=each.index, notes=each.notes,
+                            frequency=each.frequency, physical_unit=each.physical_unit,
+                            physical_dimension=each.physical_dimension, value=value)
+            for each, value in zip(sources, outputs)]
+
+def gaussian_kernel(fs, sigma, truncate=4.0):
+    """gaussian kernel sampled at fs, spanning +/- truncate * sigma seconds.
+
+    arguments:
+    fs: sampling rate.
+    sigma: standard deviation in seconds.
+
+    key arguments:
+    truncate: half width of the kernel in units of sigma.
+
+    returns:
+    kernel normalized to unit sum, with an odd number of taps.
+    """
+    half = max(int(np.ceil(truncate * sigma * fs)), 1)
+    ktime = np.arange(-half, half + 1) / fs
+    kernel = np.exp(-ktime ** 2 / (2 * sigma ** 2))
     return kernel / np.sum(kernel)
 
-def gaussianwind(data, fs, sigma):
-    k = gaussian_kernel(fs, sigma)
-    totalpwr_filter = np.convolve(data, k)
-    return totalpwr_filter[fs:-fs+1]
\ No newline at end of file
+# poles of the third order recursive gaussian of sigma 2, from Young, van
+# Vliet & van Ginkel (2002), as |d| > 1, i.e. the z-plane poles are 1/d.
+_GAUSSIAN_POLES = np.array([1.41650 + 1.00829j, 1.41650 - 1.00829j, 1.86543])
+
+@lru_cache(maxsize=64)
+def _recursive_gaussian_design(s):
+    # the poles are scaled as d**(1/q), with q chosen so that the variance
+    # of the forward and backward pass, 2 * sum(d/(d-1)**2), is s**2.
+    variance = lambda q: np.real(2 * np.sum(_GAUSSIAN_POLES ** (1 / q) /
+                                            (_GAUSSIAN_POLES ** (1 / q) - 1) ** 2))
+    q = optimize.brentq(lambda q: variance(q) - s ** 2, 1e-2, max(s, 1.0))
+    a = np.real(np.poly(1 / _GAUSSIAN_POLES ** (1 / q)))
+    return [np.sum(a)], a
+
+def _recursive_gaussian(data, s, axis):
+    # third order recursive gaussian, run forward and backward; s is sigma
+    # in samples.
+    b, a = _recursive_gaussian_design(float(s))
+    forward = signal.lfilter(b, a, data, axis=axis)
+    backward = signal.lfilter(b, a, np.flip(forward, axis), axis=axis)
+    return np.flip(backward, axis)
+
+def gaussianwind(data, fs, sigma, axis=-1, method='auto', truncate=4.0):
+    """smooth data with a gaussian window along one axis.
+
+    the signal is zero padded at both ends and the output keeps the input
+    shape, so a 2D power map is smoothed along time in a single call.
+
+    arguments:
+    data: array to be smoothed.
+    fs: sampling rate.
+    sigma: standard deviation of the window in seconds.
+
+    key arguments:
+    axis: axis to smooth along.
+    method: 'fft' for exact convolution (overlap-add FFT), 'iir' for the
+        recursive approximation whose cost does not depend on sigma, with
+        the same width and about 1% of the peak off the exact window, or
+        'auto' to use 'iir' once the kernel exceeds 1024 taps.
+    truncate: half width of the kernel in units of sigma.
+
+    returns:
+    smoothed array with the same shape as data.
+    """
+    data = np.asarray(data, dtype=np.result_type(data, np.float64))
+    axis = axis % data.ndim
+    if method == 'auto':
+        method = 'iir' if 2 * truncate * sigma * fs > 1024 else 'fft'
+    if method == 'iir':
+        return _recursive_gaussian(data, sigma * fs, axis)
+    elif method != 'fft':
+        raise ValueError("unknown smoothing method: %s"%method)
+    k = gaussian_kernel(fs, sigma, truncate)
+    shape = [1] * data.ndim
+    shape[axis] = k.size
+    k = k.reshape(shape)
+    if k.size >= data.shape[axis]:
+        return signal.fftconvolve(data, k, mode='same', axes=axis)
+    return signal.oaconvolve(data, k, mode='same', axes=axis)
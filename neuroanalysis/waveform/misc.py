@@ -1,58 +1,228 @@
 import numpy as np
+from numpy.lib.stride_tricks import as_strided
 
-def create_epoch_bymarker(data, marker, roi, fs, mbias=0):
-    gap = int(np.ceil((roi[1] - roi[0]) * fs))
-    result = np.zeros((np.size(data, 0), gap, len(marker)), dtype=data.dtype)
-    for midx, eachm in enumerate(marker):
-        start = int(np.floor((eachm + roi[0] + mbias) * fs))
-        result[:, :, midx] = data[:, start:start+gap]
-    return result
+def epoch_starts(marker, roi, fs, mbias=0):
+    """
+    start index of each epoch and the epoch length, in samples.
 
-def create_1d_epoch_bymarker(data, marker, roi, fs, mbias=0):
+    arguments:
+    - marker: marker time points (1d)
+    - roi: region of interest, (starttime, endtime) relative to markers
+    - fs: sampling rate
+
+    key arguments:
+    - mbias: time bias added to every marker [default: 0]
+
+    returns:
+    - (starts, gap): start index array (1d) and number of points of each epoch
+    """
     gap = int(np.ceil((roi[1] - roi[0]) * fs))
-    result = np.zeros((len(marker), gap), dtype=data.dtype)
-    for midx, eachm in enumerate(marker):
-        start = int(np.floor((eachm + roi[0] + mbias) * fs))
-        result[midx, :] = data[start:start+gap]
-    return result
+    starts = np.floor((np.asarray(marker, dtype='float64') + roi[0] + mbias) * fs).astype('int64')
+    return starts, gap
 
-def detect_cross_pnt(arr, thr, way='up', gap=1):
+def create_epoch(data, marker, roi, fs, mbias=0, bounds='error', fill=0,
+                 view=False, return_index=False):
     """
-    detect the data rise/down point, returns the index of the
-    point right above the threshold.
+    cut epochs around markers, with all start indices computed at once.
+
+    the epochs are gathered from the data in a single indexing operation,
+    so memory-mapped signals, e.g. the channel values of
+    `EDFData.load(mode='mmap')` or `CscReader.signal`, are only read where
+    the epochs are. with `view=True` and markers on a regular grid, a
+    read-only strided view of the data is returned instead, without copy.
+
+    arguments:
+    - data: 1d signal, or nd array with time as the last axis, or a list
+            of 1d signals (stacked as channels)
+    - marker: marker time points (1d)
+    - roi: region of interest, (starttime, endtime) relative to markers
+    - fs: sampling rate
+
+    key arguments:
+    - mbias: time bias added to every marker [default: 0]
+    - bounds: policy for epochs running past the data, "error" raises
+              ValueError, "drop" skips them and "pad" fills the missing
+              points with `fill` [default: "error"]
+    - fill: value of the padded points [default: 0]
+    - view: return a strided view when the epochs are evenly spaced
+            ndarray slices, otherwise a copy anyway [default: False]
+    - return_index: also return the index of the markers kept [default: False]
+
+    returns:
+    - epochs: (..., n_epochs, gap) array
+    - [index]: index array (1d) of the markers of each epoch
+    """
+    if bounds not in ('error', 'drop', 'pad'):
+        raise ValueError("unknown `bounds` value.")
+    if isinstance(data, (list, tuple)):
+        result = [create_epoch(each, marker, roi, fs, mbias, bounds, fill, view, True)
+                  for each in data]
+        epochs = np.stack([each[0] for each in result])
+        return (epochs, result[0][1]) if return_index else epochs
+
+    starts, gap = epoch_starts(marker, roi, fs, mbias)
+    npnt = data.shape[-1]
+    index = np.arange(len(starts))
+    valid = (starts >= 0) & (starts + gap <= npnt)
+    if not np.all(valid):
+        if bounds == 'error':
+            raise ValueError("epochs %s run past the data."%index[~valid])
+        elif bounds == 'drop':
+            starts, index = starts[valid], index[valid]
+
+    steps = np.diff(starts)
+    regular = len(starts) > 0 and np.all(steps == steps[:1])
+    if view and regular and isinstance(data, np.ndarray) and (np.all(valid) or bounds == 'drop'):
+        step = steps[0] if len(steps) else 0
+        epochs = as_strided(data[..., starts[0]:],
+                            shape=data.shape[:-1] + (len(starts), gap),
+                            strides=data.strides[:-1] + (step * data.strides[-1], data.strides[-1]),
+                            writeable=False)
+        return (epochs, index) if return_index else epochs
+
+    points = starts[:, None] + np.arange(gap)
+    if bounds == 'pad':
+        outside = (points < 0) | (points >= npnt)
+        points = np.clip(points, 0, max(npnt - 1, 0))
+    if isinstance(data, np.ndarray):
+        epochs = data[..., points]
+    else:
+        epochs = np.asarray(data[points])
+    if bounds == 'pad' and np.any(outside):
+        epochs = np.array(epochs)
+        epochs[..., outside] = fill
+
+    return (epochs, index) if return_index else epochs
+
+def create_epoch_bymarker(data, marker, roi, fs, mbias=0, bounds='error'):
+    """
+    epochs of 2d (channel, time) data, as (channel, gap, n_epochs) array.
+    see `create_epoch`.
+    """
+    return np.moveaxis(create_epoch(data, marker, roi, fs, mbias, bounds), -2, -1)
+
+def create_1d_epoch_bymarker(data, marker, roi, fs, mbias=0, bounds='error'):
+    """
+    epochs of 1d data, as (n_epochs, gap) array. see `create_epoch`.
+    """
+    return create_epoch(data, marker, roi, fs, mbias, bounds)
+
+def _enforce_gap(idx, gap, last=None):
+    """keep crossings more than `gap` points after the previous kept one."""
+    if last is not None:
+        idx = idx[idx - last > gap]
+    if len(idx) < 2 or np.all(np.diff(idx) > gap):
+        return idx
+    # greedy over the kept ones only, jumping to the next valid crossing
+    _next = np.searchsorted(idx, idx + gap, side='right')
+    keep = []
+    i = 0
+    while i < len(idx):
+        keep.append(i)
+        i = _next[i]
+    return idx[keep]
+
+def _crossings(arr, thr, hysteresis, state):
+    """rising and falling crossing indices of arr, and the state at its end."""
+    arr = np.asarray(arr)
+    level = np.zeros(len(arr), dtype='int8')
+    level[arr > thr + hysteresis / 2] = 1
+    level[arr < thr - hysteresis / 2] = -1
+
+    # hold the last level outside of the hysteresis band
+    last = np.where(level != 0, np.arange(len(arr)), -1)
+    np.maximum.accumulate(last, out=last)
+    level = np.where(last >= 0, level[last], state)
+    previous = np.hstack((state, level[:-1]))[:len(level)]
+
+    rising, = np.where((level == 1) & (previous == -1))
+    falling, = np.where((level == -1) & (previous == 1))
+    return rising, falling, (level[-1] if len(level) else state)
+
+def detect_crossings(arr, thr, way='up', gap=1, hysteresis=0):
+    """
+    detect threshold crossings, vectorized.
+
+    a rising crossing is the first point above `thr + hysteresis/2` after
+    the data was below `thr - hysteresis/2`, and the other way around for
+    a falling crossing; points inside the band keep the previous level.
 
     arguments:
     - arr: data array (1d)
     - thr: threshold (scale)
 
     key arguments:
-    - way: either be "up" or "down", for data rise/ data down respectively.
-    - gap: the least points between two valid markers.
+    - way: "up", "down" or "both", for data rise/ data down/ either.
+    - gap: the least points between two valid markers of the same way.
+    - hysteresis: width of the band around thr [default: 0]
 
     returns:
-    - _marker_idx: index array (1d)
+    - index array (1d), sorted
+    """
+    if way not in ('up', 'down', 'both'):
+        raise ValueError("unknown `way` value.")
+    rising, falling, _ = _crossings(arr, thr, hysteresis, 0)
+    rising, falling = _enforce_gap(rising, gap), _enforce_gap(falling, gap)
+    if way == 'up':
+        return rising
+    elif way == 'down':
+        return falling
+    return np.sort(np.hstack((rising, falling)))
+
+def detect_crossings_stream(blocks, thr, way='up', gap=1, hysteresis=0):
     """
+    detect threshold crossings over consecutive data blocks.
 
-    _idx, = np.where(arr > thr)
-    _idx_diff, = np.where(np.diff(_idx) > 1)
-    _idx_repo = np.hstack((_idx[0], _idx[_idx_diff], _idx[_idx_diff+1], _idx[-1]))
+    the level and the last valid markers are carried across the block
+    boundaries, so the result is the same as `detect_crossings` on the
+    concatenated data, e.g. streamed from `CscReader.iter_chunks`.
 
-    if way == 'up':
-        _check = lambda x, i: x[i-1] < thr < x[i] #< x[i+1]
-    elif way =='down':
-        _check = lambda x, i: x[i-1] > x[i] > x[i+1]
-    else:
+    arguments:
+    - blocks: iterable of data arrays (1d)
+    - thr: threshold (scale)
+
+    key arguments:
+    - way, gap, hysteresis: as in `detect_crossings`
+
+    yields:
+    - index array (1d) of the crossings in each block, counted from the
+      start of the first block
+    """
+    if way not in ('up', 'down', 'both'):
         raise ValueError("unknown `way` value.")
+    state, offset = 0, 0
+    last_rising, last_falling = None, None
+    for block in blocks:
+        rising, falling, state = _crossings(block, thr, hysteresis, state)
+        rising = _enforce_gap(rising + offset, gap, last_rising)
+        falling = _enforce_gap(falling + offset, gap, last_falling)
+        if len(rising):
+            last_rising = rising[-1]
+        if len(falling):
+            last_falling = falling[-1]
+        offset += len(block)
+
+        if way == 'up':
+            yield rising
+        elif way == 'down':
+            yield falling
+        else:
+            yield np.sort(np.hstack((rising, falling)))
+
+def detect_cross_pnt(arr, thr, way='up', gap=1):
+    """
+    detect the data rise/down point, returns the index of the
+    point right above (or below) the threshold.
+
+    arguments:
+    - arr: data array (1d)
+    - thr: threshold (scale)
+
+    key arguments:
+    - way: either be "up" or "down", for data rise/ data down respectively.
+    - gap: the least points between two valid markers.
 
-    _idx_repo.sort()
-    _result = []
-    _previous = -9999
-    for idx in _idx_repo:
-        try:
-            if _check(arr, idx) and (idx - _previous > gap):
-                _result.append(idx)
-                _previous = idx
-        except IndexError:
-            pass
-
-    return _result
+    returns:
+    - _marker_idx: index list (1d)
+    """
+    return detect_crossings(arr, thr, way, gap).tolist()
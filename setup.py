@@ -52,7 +52,7 @@ setup(
     author_email=EMAIL,
     python_requires=REQUIRES_PYTHON,
     url=URL,
-    packages=find_packages(exclude=('tests',)),
+    packages=find_packages(exclude=('tests', 'benchmark')),
     # If your package is a single module, use this instead of 'packages':
     # py_modules=['mypackage'],
 
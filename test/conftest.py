@@ -0,0 +1,6 @@
+import os
+import sys
+
+# the tests write their data files with the benchmark generators, which are
+# not installed with the package
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
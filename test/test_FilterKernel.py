@@ -1,7 +1,51 @@
-import spike
+from neuroanalysis import spike
+import numpy as np
 import pytest
 
 def test_gaussian():
     k = spike.kernel('gaussian',sigma=1)
     assert k(0) == 0.3989422804014327
     return
+
+@pytest.mark.parametrize('name, args', [('gaussian', {'sigma': 0.05}),
+                                        ('causal', {'alpha': 20}),
+                                        ('square', {'delta': 0.1})])
+def test_binned_filter(name, args):
+    train = np.sort(np.random.RandomState(0).uniform(0, 100, 2000))
+    k = spike.kernel(name, **args)
+    x, exact = spike.apply_linear_filter(train, k, (10, 90), 8001)
+    binned = spike.apply_linear_filter(train, k, (10, 90), 8001, returnX=False,
+                                       method='binned', resolution=0.0005)
+    assert np.abs(binned - exact).max() < 1e-4 * exact.max()
+    return
+
+def test_windowed_exact_filter():
+    train = np.sort(np.random.RandomState(1).uniform(0, 100, 2000))
+    k = spike.kernel('gaussian', sigma=0.05, truncate=8)
+    windowed = spike.apply_linear_filter(train, k, (10, 90), 500, returnX=False)
+    full = spike.apply_linear_filter(train, lambda t: k(t), (10, 90), 500, returnX=False)
+    assert np.allclose(windowed, full, rtol=0, atol=1e-12)
+    return
+
+def test_filter_withroi():
+    rs = np.random.RandomState(2)
+    train = np.sort(rs.uniform(0, 100, 2000))
+    starts = rs.uniform(5, 95, 20)
+    k = spike.kernel('causal', alpha=20)
+    response = spike.apply_linear_filter_withroi(train, k, starts, (-0.5, 1), 300)
+    binned = spike.apply_linear_filter_withroi(train, k, starts, (-0.5, 1), 300,
+                                               method='binned', resolution=0.0005)
+    assert response.shape == (20, 300)
+    for idx, each in enumerate(starts):
+        expect = spike.apply_linear_filter(train, k, (each-0.5, each+1), 300, returnX=False)
+        assert np.allclose(response[idx], expect, rtol=1e-12, atol=1e-12)
+        assert np.abs(binned[idx] - expect).max() < 5e-3 * expect.max()
+
+    # the default grid step is the step of a trial, whatever the span of the starts
+    coarse = spike.apply_linear_filter_withroi(train, k, starts, (-0.5, 1), 300, method='binned')
+    assert np.abs(coarse - response).max() < 2e-2 * response.max()
+
+    for method in ['exact', 'binned']:
+        empty = spike.apply_linear_filter_withroi(train, k, [], (-0.5, 1), 300, method=method)
+        assert empty.shape == (0, 300)
+    return
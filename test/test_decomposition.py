@@ -0,0 +1,89 @@
+import numpy as np
+from neuroanalysis import waveform
+from neuroanalysis.waveform.decomposition import morlet
+
+
+def _reference_dwt(data, fs, frange):
+    nConv = np.size(data, -1) + int(2*fs)
+    fft_data = np.fft.fft(data, nConv)
+    Dwt = np.zeros((np.size(frange), np.size(data, 0), np.size(data, 1)), dtype="complex")
+    for idx, F in enumerate(frange):
+        conv_wave = np.fft.ifft(np.fft.fft(morlet(F, fs), nConv) * fft_data, nConv)
+        Dwt[idx, :, :] = conv_wave[:, fs:-fs]
+    return Dwt
+
+
+def test_dwt_batched():
+    rs = np.random.RandomState(0)
+    data = rs.randn(6, 700)
+    frange = np.arange(4, 40, 3)
+    expect = _reference_dwt(data, 200, frange)
+
+    assert np.allclose(waveform.dwt(data, 200, frange, freq_chunk=5), expect)
+    single = waveform.dwt(data, 200, frange, dtype='complex64')
+    assert single.dtype == np.complex64
+    assert np.allclose(single, expect, atol=1e-4 * np.abs(expect).max())
+
+
+def test_dwt_reduce():
+    rs = np.random.RandomState(1)
+    data = rs.randn(9, 600)
+    frange = np.arange(4, 40, 3)
+    full = waveform.dwt(data, 200, frange)
+
+    power, itpc = waveform.dwt_reduce(data, 200, frange, freq_chunk=4, trial_chunk=4)
+    assert np.allclose(power, np.mean(np.abs(full) ** 2.0, 1))
+    assert np.allclose(itpc, waveform.dwt_itpc(full))
+    assert np.allclose(waveform.normalize_power(power, 200, zscore=True),
+                       waveform.dwt_power(full, 200, zscore=True))
+
+
+def test_dwt_parallel(tmp_path):
+    rs = np.random.RandomState(2)
+    data = rs.randn(3, 4, 500)
+    frange = np.arange(4, 40, 3)
+
+    assert np.allclose(waveform.dwt(data[0], 200, frange, n_jobs=3), waveform.dwt(data[0], 200, frange))
+    channels = waveform.dwt_channels(data, 200, frange, n_jobs=2, filename=str(tmp_path / 'dwt.npy'))
+    assert channels.shape == (3, 12, 4, 500)
+    for idx in range(3):
+        assert np.allclose(channels[idx], waveform.dwt(data[idx], 200, frange))
+
+
+def test_wavelet_cache_bytes(monkeypatch):
+    from neuroanalysis.waveform import decomposition
+    waveform.clear_wavelet_cache()
+    data = np.random.RandomState(3).randn(2, 800)
+    frange = np.arange(4, 40, 3)
+    expect = waveform.dwt(data, 200, frange)
+    # each spectrum is 800 + 2*200 complex128 points, 19200 bytes
+    monkeypatch.setattr(decomposition, 'WAVELET_CACHE_BYTES', 5 * 19200)
+    waveform.clear_wavelet_cache()
+    assert np.array_equal(waveform.dwt(data, 200, frange), expect)
+    assert sum(each.nbytes for each, _ in decomposition._spectra.values()) <= 5 * 19200
+    assert len(decomposition._spectra) == 5
+
+    monkeypatch.setattr(decomposition, 'WAVELET_CACHE_BYTES', 1000)
+    waveform.clear_wavelet_cache()
+    assert np.array_equal(waveform.dwt(data, 200, frange), expect)
+    assert len(decomposition._spectra) == 0
+
+
+def test_dwt_reduce_memory():
+    import tracemalloc
+    data = np.random.RandomState(5).randn(100, 2000)
+    frange = np.arange(4, 44, 2)
+    full = np.size(frange) * data.size * 16
+    waveform.dwt_reduce(data[:2], 500, frange)
+
+    tracemalloc.start()
+    try:
+        power, itpc = waveform.dwt_reduce(data, 500, frange)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    assert peak < full / 4
+
+    decomposed = waveform.dwt(data, 500, frange)
+    assert np.allclose(power, np.mean(np.abs(decomposed) ** 2, 1))
+    assert np.allclose(itpc, waveform.dwt_itpc(decomposed))
@@ -0,0 +1,133 @@
+import numpy as np
+import pytest
+from neuroanalysis.reader import EDFData
+from benchmark.generators import write_edf
+
+
+@pytest.fixture
+def edf_file(tmp_path):
+    data = np.random.RandomState(0).randint(-1000, 1000, (4, 1000)).astype('i2')
+    filename = str(tmp_path / 'sample.edf')
+    write_edf(filename, data)
+    return filename, data
+
+
+def test_mmap_matches_all(edf_file):
+    filename, data = edf_file
+    a = EDFData(filename)
+    a.load(mode='all')
+    b = EDFData(filename)
+    b.load(mode='mmap')
+
+    for idx in range(4):
+        _lazy = b.continuous_channels[idx].value
+        assert len(_lazy) == 1000
+        assert np.array_equal(np.asarray(_lazy), a.continuous_channels[idx].value)
+        assert np.array_equal(_lazy[150:420:3], data[idx, 150:420:3])
+        assert np.array_equal(_lazy[[5, 999, -1]], data[idx, [5, 999, -1]])
+        assert _lazy[-2] == data[idx, -2]
+
+
+def test_read_channels(edf_file):
+    filename, data = edf_file
+    a = EDFData(filename)
+    a.load()
+
+    _window = a.read_channels([3, 1], 1.55, 3.05)
+    _unit = a.continuous_channels[0].physical_unit
+    _expect = (data[[3, 1], 155:305].astype(float) + 32768) * _unit - 3276.8
+    assert _window.shape == (2, 150)
+    assert np.allclose(_window, _expect)
+    assert np.array_equal(a.load(mode='channel', index=2), data[2])
+
+
+def test_export_hdf5_streams_chunks(edf_file, tmp_path):
+    import h5py
+    filename, data = edf_file
+    raw = EDFData(filename)
+    raw.load(mode='mmap')
+    target = str(tmp_path / 'export.h5')
+    raw.export_hdf5(target, compression={'ch0': 'gzip', 'ch1': 'lzf'},
+                    shuffle={'ch0': True}, chunk_samples=128, block=300)
+
+    with h5py.File(target, 'r') as f:
+        assert f['continuous/ch0/value'].compression == 'gzip'
+        assert f['continuous/ch0/value'].shuffle
+        assert f['continuous/ch1/value'].compression == 'lzf'
+        assert f['continuous/ch2/value'].compression is None
+        for idx in range(4):
+            _value = f['continuous/ch%d/value'%idx]
+            assert _value.chunks == (128,)
+            assert np.array_equal(_value[()], data[idx])
+
+
+def test_restore_hdf5_lazy(edf_file, tmp_path):
+    from neuroanalysis.reader import RawData
+    filename, data = edf_file
+    raw = EDFData(filename)
+    raw.load(mode='mmap')
+    target = str(tmp_path / 'export.h5')
+    raw.export_hdf5(target, compression='gzip')
+
+    restored = RawData(target)
+    restored.restore_hdf5()
+    assert restored.filename == filename
+    assert [each.name for each in restored.continuous_channels] == ['ch0', 'ch1', 'ch2', 'ch3']
+    _value = restored.continuous_channels[2].value
+    assert _value.shape == (1000,)
+    assert np.array_equal(_value[10:500:7], data[2, 10:500:7])
+    assert np.array_equal(_value[[900, 3, 3, -1]], data[2, [900, 3, 3, -1]])
+    assert np.array_equal(_value[::-3], data[2, ::-3])
+    assert np.array_equal(_value.window(2.5, 4.0), data[2, 250:400])
+    assert np.array_equal(np.asarray(_value), data[2])
+
+    _ch = restored.restore_hdf5_channel('continuous', 'ch1', lazy=False)
+    assert restored.continuous_channels[1] is _ch
+    assert np.array_equal(_ch.value, data[1])
+    assert np.array_equal(_value[:5], data[2, :5])
+    restored.close_hdf5()
+
+
+def test_restore_hdf5_order(tmp_path):
+    from neuroanalysis.reader import RawData
+    data = np.random.RandomState(3).randint(-1000, 1000, (12, 300)).astype('i2')
+    filename = str(tmp_path / 'wide.edf')
+    write_edf(filename, data)
+    raw = EDFData(filename)
+    raw.load(mode='mmap')
+    raw.export_hdf5(str(tmp_path / 'wide.h5'))
+
+    restored = RawData(str(tmp_path / 'wide.h5'))
+    restored.restore_hdf5(lazy=False)
+    assert [each.name for each in restored.continuous_channels] == ['ch%d'%idx for idx in range(12)]
+    for idx in range(12):
+        assert np.array_equal(restored.continuous_channels[idx].value, data[idx])
+
+
+def test_restore_hdf5_channel_files(edf_file, tmp_path):
+    from neuroanalysis.reader import RawData
+    filename, data = edf_file
+    raw = EDFData(filename)
+    raw.load(mode='mmap')
+    first, second = str(tmp_path / 'a.h5'), str(tmp_path / 'b.h5')
+    raw.export_hdf5(first)
+    raw.export_hdf5(second)
+
+    # the file restored from is remembered, not the origin
+    restored = RawData(first)
+    restored.restore_hdf5(lazy=False)
+    assert restored.filename == filename
+    _ch = restored.restore_hdf5_channel('continuous', 'ch1')
+    assert np.array_equal(_ch.value[:], data[1])
+    restored.close_hdf5()
+
+    # another file does not close the one of the lazy values
+    restored = RawData(first)
+    restored.restore_hdf5()
+    _value = restored.continuous_channels[0].value
+    _ch = restored.restore_hdf5_channel('continuous', 'ch2', filename=second)
+    _eager = restored.restore_hdf5_channel('continuous', 'ch3', filename=second, lazy=False)
+    assert np.array_equal(_value[:], data[0])
+    assert np.array_equal(_ch.value[:], data[2])
+    assert np.array_equal(_eager.value, data[3])
+    restored.close_hdf5()
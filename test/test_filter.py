@@ -0,0 +1,74 @@
+import numpy as np
+import scipy.signal as signal
+from neuroanalysis import waveform
+
+
+def test_sos_filters():
+    rs = np.random.RandomState(0)
+    data = rs.randn(3, 20000)
+
+    b, a = signal.butter(4, [300/15000, 3000/15000], 'bandpass')
+    expect = signal.filtfilt(b, a, data)
+    assert np.allclose(waveform.butter_bandpass_filter(data, (300, 3000), 30000), expect, atol=1e-6)
+    assert waveform.filter_design('butter', 4, (300, 3000), 30000, 'bandpass') is \
+        waveform.filter_design('butter', 4, [300, 3000], 30000, 'bandpass')
+
+    whole = waveform.butter_highpass_filter(data, 300, 30000)
+    blocks = waveform.butter_highpass_filter(data.T, 300, 30000, axis=0, block=3000)
+    assert np.allclose(blocks.T, whole, atol=1e-6)
+    assert np.allclose(waveform.bessel_highpass_filter(data[0], 300, 30000, block=4096),
+                       waveform.bessel_highpass_filter(data[0], 300, 30000), atol=1e-6)
+
+
+def test_filter_channels(tmp_path):
+    from benchmark.generators import write_edf
+    from neuroanalysis.reader import EDFData
+
+    data = np.random.RandomState(1).randint(-1000, 1000, (4, 20000)).astype('i2')
+    write_edf(str(tmp_path / 'raw.edf'), data, nsamp=1000)
+    raw = EDFData(str(tmp_path / 'raw.edf'))
+    raw.load(mode='mmap')
+
+    expect = waveform.butter_highpass_filter(data.astype('float64'), 50, 1000)
+    for filename in [None, str(tmp_path / 'filtered.h5'), str(tmp_path / 'filtered')]:
+        filtered = waveform.filter_channels(raw, channels=[0, 'ch2'], cutoff=50, n_jobs=2,
+                                            filename=filename, block=5000)
+        assert [each.name for each in filtered] == ['ch0', 'ch2']
+        assert np.allclose(filtered[1].value[:], expect[2], atol=1e-6)
+
+    # channels at different rates are filtered with their own design
+    from neuroanalysis.reader.rawdata import RawData, AbstractChannel
+    mixed = RawData('mixed')
+    mixed.continuous_channels = [AbstractChannel(name='slow', frequency=1000, value=data[0].astype(float)),
+                                 AbstractChannel(name='fast', frequency=4000, value=data[1].astype(float))]
+    filtered = waveform.filter_channels(mixed, cutoff=50)
+    assert np.allclose(filtered[0].value, expect[0], atol=1e-6)
+    assert np.allclose(filtered[1].value,
+                       waveform.butter_highpass_filter(data[1].astype('float64'), 50, 4000), atol=1e-6)
+
+
+def test_gaussianwind():
+    from neuroanalysis.waveform.filter import gaussianwind, gaussian_kernel
+
+    data = np.random.RandomState(2).randn(3, 5000)
+    k = gaussian_kernel(1000, .05)
+    assert k.size == 401 and np.isclose(k.sum(), 1)
+
+    smooth = gaussianwind(data, 1000, .05, method='fft')
+    assert smooth.shape == data.shape
+    for row, each in zip(data, smooth):
+        assert np.allclose(each, np.convolve(row, k, 'same'))
+    assert np.allclose(gaussianwind(data.T, 1000, .05, axis=0), smooth.T)
+
+    approx = gaussianwind(data, 1000, .05, method='iir')
+    assert np.abs(approx - smooth)[:, 500:-500].max() < .02 * np.abs(smooth).max()
+
+    # the recursive window keeps the requested width at large sigma
+    for sigma in [.2, 1.0]:
+        impulse = np.zeros(int(20 * sigma * 1000) + 1)
+        impulse[impulse.size // 2] = 1
+        t = (np.arange(impulse.size) - impulse.size // 2) / 1000
+        exact = gaussianwind(impulse, 1000, sigma, method='fft')
+        approx = gaussianwind(impulse, 1000, sigma)
+        assert np.isclose(np.sqrt(np.sum(approx * t ** 2) / np.sum(approx)), sigma, rtol=1e-3)
+        assert np.abs(approx - exact).max() < .015 * exact.max()
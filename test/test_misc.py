@@ -0,0 +1,43 @@
+import numpy as np
+import pytest
+from neuroanalysis import waveform
+
+
+def test_create_epoch():
+    data = np.arange(3000, dtype='float64').reshape((3, 1000))
+    marker = [0.5, 2.0, 3.2]
+
+    epochs = waveform.create_epoch_bymarker(data, marker, (-0.1, 0.4), 200)
+    assert epochs.shape == (3, 100, 3)
+    assert np.array_equal(epochs[1, :, 2], data[1, 620:720])
+    assert np.array_equal(waveform.create_1d_epoch_bymarker(data[0], marker, (-0.1, 0.4), 200),
+                          data[0, [np.arange(80, 180), np.arange(380, 480), np.arange(620, 720)]])
+
+    with pytest.raises(ValueError):
+        waveform.create_epoch(data, [0.0, 4.9], (-0.1, 0.4), 200)
+    dropped, index = waveform.create_epoch(data, [0.0, 1.0, 4.9], (-0.1, 0.4), 200,
+                                           bounds='drop', return_index=True)
+    assert dropped.shape == (3, 1, 100) and list(index) == [1]
+    padded = waveform.create_epoch(data[0], [4.9], (-0.1, 0.4), 200, bounds='pad', fill=-1)
+    assert np.array_equal(padded[0], np.hstack((np.arange(960, 1000), -np.ones(60))))
+
+    view = waveform.create_epoch(data, np.arange(0.5, 4.0, 0.5), (0, 0.5), 200, view=True)
+    assert not view.flags.writeable and np.shares_memory(view, data)
+    assert np.array_equal(view, waveform.create_epoch(data, np.arange(0.5, 4.0, 0.5), (0, 0.5), 200))
+
+
+def test_detect_crossings():
+    rs = np.random.RandomState(0)
+    ttl = np.zeros(20000)
+    for each in [1000, 5000, 5003, 9000, 15000]:
+        ttl[each:each+300] = 5
+    noisy = ttl + rs.uniform(-0.4, 0.4, ttl.size)
+    noisy[9150] = 2.4    # a glitch inside the hysteresis band
+
+    assert list(waveform.detect_crossings(noisy, 2.5, gap=10, hysteresis=1)) == [1000, 5000, 9000, 15000]
+    assert list(waveform.detect_crossings(noisy, 2.5, 'down', hysteresis=1)) == [1300, 5303, 9300, 15300]
+    assert waveform.detect_cross_pnt(ttl, 2.5) == [1000, 5000, 9000, 15000]
+
+    streamed = waveform.detect_crossings_stream(np.array_split(noisy, 7), 2.5, 'both', gap=10, hysteresis=1)
+    assert np.array_equal(np.hstack(list(streamed)),
+                          waveform.detect_crossings(noisy, 2.5, 'both', gap=10, hysteresis=1))
@@ -0,0 +1,31 @@
+import numpy as np
+import pytest
+from neuroanalysis.reader_ import neurolynx_read_csc
+from benchmark.generators import write_ncs
+
+
+@pytest.fixture
+def ncs_file(tmp_path):
+    csc = np.random.RandomState(0).randint(-2000, 2000, 512*37).astype('i2')
+    filename = str(tmp_path / 'CSC1.ncs')
+    write_ncs(filename, csc)
+    return filename
+
+
+def test_iter_chunks(ncs_file):
+    full = neurolynx_read_csc(ncs_file)
+    lazy = neurolynx_read_csc(ncs_file, mmap=True)
+
+    _chunks = list(lazy.iter_chunks(10))
+    assert [len(c) for _, c in _chunks] == [5120, 5120, 5120, 3584]
+    assert np.allclose(np.hstack([t for t, _ in _chunks]), full._time)
+    assert np.allclose(np.hstack([c for _, c in _chunks]), full._csc)
+
+
+def test_time_lookup(ncs_file):
+    csc = neurolynx_read_csc(ncs_file, mmap=True)
+    _time = np.hstack([t for t, _ in csc.iter_chunks(10)])
+
+    assert np.allclose(csc.get_time(700, 2100), _time[700:2100])
+    _t = [0, 1000000, 1000010.3, 1300000.7, _time[-1] + 5]
+    assert np.array_equal(csc.time_to_index(_t), np.searchsorted(_time, _t))
@@ -0,0 +1,185 @@
+import numpy as np
+from neuroanalysis import spike
+
+
+def _reference_psth(train, marker, ROI, binsize):
+    _bins = int((ROI[-1]-ROI[0])/binsize)
+    _psth = np.zeros(_bins, dtype='int')
+    _seg = []
+    for _item in marker:
+        _seg_train = train[(_item+ROI[0]<train)&(train<_item+ROI[-1])]-_item
+        _psth = _psth + np.histogram(_seg_train, range=ROI, bins=_bins)[0]
+        _seg.append(_seg_train)
+    return _psth/np.size(marker)/binsize, _seg
+
+
+def test_psth_identical():
+    rs = np.random.RandomState(1)
+    train = np.sort(rs.uniform(0, 500, 20000))
+    marker = np.hstack((rs.uniform(0, 500, 300), train[:20] + 0.5))
+
+    _psth, _seg = spike.PSTH(train, marker, (-0.5, 1.0), 0.05, skip_plot=True)
+    _expect, _expect_seg = _reference_psth(train, marker, (-0.5, 1.0), 0.05)
+    assert np.array_equal(_psth, _expect)
+    assert all([np.array_equal(a, b) for a, b in zip(_seg, _expect_seg)])
+
+    _offsets, _values = spike.segment_train(train, marker, (-0.5, 1.0))
+    assert np.array_equal(np.diff(_offsets), [len(each) for each in _expect_seg])
+
+
+def test_psth_raster_contract():
+    rs = np.random.RandomState(3)
+    train = rs.uniform(0, 100, 2000)
+    marker = rs.uniform(0, 100, 30)
+
+    _psth, _seg = spike.PSTH(train, marker, (-0.5, 1.0), 0.05, skip_plot=True)
+    _expect, _expect_seg = _reference_psth(train, marker, (-0.5, 1.0), 0.05)
+    assert np.array_equal(_psth, _expect)
+    assert all([np.array_equal(a, b) for a, b in zip(_seg, _expect_seg)])
+
+    _, _seg = spike.PSTH(np.array([1., 5., 0.]), np.array([0.5]), (-2, 2), skip_plot=True)
+    assert np.array_equal(_seg[0], [0.5, -0.5])
+    with np.errstate(invalid='ignore'):  # no trials to average
+        _, _seg = spike.PSTH(train, np.array([]), (-0.5, 1.0), skip_plot=True)
+    assert _seg == []
+
+
+def test_batch_psth():
+    rs = np.random.RandomState(2)
+    units = {'ch%d'%idx: np.sort(rs.uniform(0, 200, 3000)) for idx in range(5)}
+    marker = {'a': rs.uniform(0, 200, 40), 'b': rs.uniform(0, 200, 25)}
+
+    for n_jobs in [1, 2]:
+        _psth, _ntrials, _names, _conditions = spike.batch_psth(
+            units, marker, (-0.2, 0.5), 0.02, n_jobs=n_jobs)
+        assert _psth.shape == (5, 2, 35)
+        assert list(_ntrials) == [40, 25]
+        for uidx, name in enumerate(_names):
+            for cidx, cond in enumerate(_conditions):
+                _expect, _ = spike.PSTH(units[name], marker[cond], (-0.2, 0.5), 0.02, skip_plot=True)
+                assert np.array_equal(_psth[uidx, cidx], _expect)
+
+
+def test_crosscorrelogram_shift():
+    rs = np.random.RandomState(3)
+    target = np.sort(rs.uniform(0, 300, 4000))
+    reference = np.sort(rs.uniform(0, 300, 2000))
+
+    _raw, _predictor = spike.correlogram(target, reference, (-0.1, 0.1), 0.005, shift=[5.0, 10.0, 20.0])
+    _expect = np.zeros(40)
+    for item in [5.0, 10.0, 20.0]:
+        _shifted = spike.multi_unit.shiftappend(reference, item)
+        _expect = _expect + _reference_psth(target, _shifted, (-0.1, 0.1), 0.005)[0]/3
+    assert np.array_equal(_raw, _reference_psth(target, reference, (-0.1, 0.1), 0.005)[0])
+    assert np.array_equal(_predictor, _expect)
+    assert np.array_equal(spike.crosscorrelogram(target, reference, (-0.1, 0.1), 0.005,
+                                                 shift=[5.0, 10.0, 20.0], skip_plot=True),
+                          _raw - _predictor)
+
+
+def test_crosscorrelogram_matrix(tmp_path):
+    rs = np.random.RandomState(4)
+    units = [np.sort(rs.uniform(0, 100, n)) for n in [800, 1200, 500]]
+
+    _matrix = spike.crosscorrelogram_matrix(units, (-0.1, 0.1), 0.01, n_jobs=2,
+                                            filename=str(tmp_path / 'ccg.npy'))
+    _shifted = spike.crosscorrelogram_matrix(units, (-0.1, 0.1), 0.01, shift=3.0)
+    for i in range(3):
+        for j in range(3):
+            _expect = spike.crosscorrelogram(units[i], units[j], (-0.1, 0.1), 0.01, skip_plot=True)
+            assert np.array_equal(_matrix[i, j], _expect)
+            _expect = spike.crosscorrelogram(units[i], units[j], (-0.1, 0.1), 0.01, shift=3.0, skip_plot=True)
+            assert np.array_equal(_shifted[i, j], _expect)
+    assert np.array_equal(np.load(str(tmp_path / 'ccg.npy')), _matrix)
+
+    # spike times on the sampling clock put many lags exactly on bin edges
+    _shared = rs.uniform(0, 100, 500)
+    units = [np.round(np.sort(np.concatenate([_shared, rs.uniform(0, 100, n)])) * 30000) / 30000
+             for n in [800, 1200]]
+    _matrix = spike.crosscorrelogram_matrix(units, (-0.05, 0.05), 0.001)
+    for i in range(2):
+        for j in range(2):
+            _expect = spike.crosscorrelogram(units[i], units[j], (-0.05, 0.05), 0.001, skip_plot=True)
+            assert np.array_equal(_matrix[i, j], _expect)
+
+
+def test_packed_session(tmp_path):
+    import os
+    demo = os.path.join(os.path.dirname(__file__), '..', 'demo')
+    target = str(tmp_path / 'sample.session')
+    trains, marker = spike.convert_session(target, 's1', 'm1', 'sample.mat', 'sample.csv',
+                                           data_dir=demo)
+    packed_trains, packed_marker = spike.load_session(target)
+
+    assert list(packed_trains) == list(trains)
+    for channel, unit in trains.items():
+        assert packed_trains[channel].session == 's1'
+        assert isinstance(packed_trains[channel].spike_train, np.memmap)
+        assert np.array_equal(packed_trains[channel].spike_train, unit.spike_train)
+    assert list(packed_marker.chunked_marker) == list(marker.chunked_marker)
+    for name, times in marker.chunked_marker.items():
+        assert np.array_equal(packed_marker.chunked_marker[name], times)
+    assert packed_marker.table_marker.equals(marker.table_marker)
+    assert np.array_equal(packed_marker._raw_table.marker, marker._raw_table.marker)
+    assert np.array_equal(packed_marker._raw_train, marker._raw_train)
+
+
+def test_import_cache(tmp_path, capsys):
+    import os, shutil
+    demo = os.path.join(os.path.dirname(__file__), '..', 'demo')
+    for name in ['sample.mat', 'sample.csv']:
+        shutil.copy(os.path.join(demo, name), str(tmp_path / name))
+    cache = str(tmp_path / 'cache')
+    load = lambda session, **kwargs: spike.import_spike_train_data(
+        session, 'm1', 'sample.mat', 'sample.csv', data_dir=str(tmp_path), cache_dir=cache, **kwargs)
+
+    trains, marker = load('s1')
+    assert 'marker shift' in capsys.readouterr().out
+    cached_trains, cached_marker = load('s1')
+    assert capsys.readouterr().out == ''
+    assert isinstance(cached_trains['WBC02a'].spike_train, np.memmap)
+    assert np.array_equal(cached_trains['WBC02a'].spike_train, trains['WBC02a'].spike_train)
+    assert np.array_equal(cached_marker.chunked_marker['G6'], marker.chunked_marker['G6'])
+
+    # a changed source is parsed again
+    os.utime(str(tmp_path / 'sample.csv'), ns=(0, 10**18))
+    load('s1')
+    assert 'marker shift' in capsys.readouterr().out
+
+    # chunkers differing only in constants or captured values are different entries
+    for size in [5, 3, 3]:
+        _, chunked = load('s1', csv_chunker=lambda t, m: (t, {'X': m[:size]}))
+        assert len(chunked.chunked_marker['X']) == size
+    _, chunked = load('s1', csv_chunker=lambda t, m: (t, {'X': m[:2]}))
+    assert len(chunked.chunked_marker['X']) == 2
+    capsys.readouterr()
+
+    # the least recently used entries are evicted beyond the size limit
+    load('s2', cache_size=1)
+    assert len(os.listdir(cache)) == 1
+
+
+def _count_spikes(spike_trains, spike_marker):
+    return {'counts': np.array([np.size(each.spike_train) for each in spike_trains.values()]),
+            'psth': {'G6': spike.PSTH(spike_trains['WBC02a'].spike_train,
+                                      spike_marker.chunked_marker['G6'], (0, 1), skip_plot=True)[0]}}
+
+
+def test_run_batch(tmp_path):
+    import os, h5py
+    demo = os.path.join(os.path.dirname(__file__), '..', 'demo')
+    manifest = [{'session': 's%d'%idx, 'mouse_id': 'm1', 'mat': 'sample.mat', 'csv': 'sample.csv'}
+                for idx in range(3)]
+    manifest.append({'session': 'missing', 'mouse_id': 'm1', 'mat': 'none.mat', 'csv': 'sample.csv'})
+    target = str(tmp_path / 'batch.h5')
+
+    status = spike.run_batch(manifest, _count_spikes, target, data_dir=demo, n_jobs=2)
+    assert [status['s%d'%idx] for idx in range(3)] == ['done'] * 3
+    assert 'Traceback' in status['missing']
+    with h5py.File(target, 'r') as f:
+        assert sorted(f.keys()) == ['s0', 's1', 's2']
+        assert f['s1'].attrs['complete'] and f['s1/counts'].shape == (10,)
+        assert f['s2/psth/G6'].shape == (10,)
+
+    status = spike.run_batch(manifest, _count_spikes, target, data_dir=demo)
+    assert status['s0'] == 'skipped' and 'Traceback' in status['missing']